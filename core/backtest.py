@@ -0,0 +1,175 @@
+import argparse
+import importlib
+import logging
+import os
+import sys
+from collections import deque
+from datetime import datetime, timezone
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from core.base_app import MessageType, Subscription
+from core.daily_gzip_json_reader import DailyGzipJsonReader
+
+
+class FillSimulator:
+    """Stands in for the execution gateways: turns strategy instructions into order lifecycle messages."""
+
+    def on_instruction(self, message):
+        return []
+
+    def on_market_data(self, message):
+        return []
+
+
+class TopOfBookFillSimulator(FillSimulator):
+    """Acknowledges limit orders at once and fills them in full when the opposite side of the book reaches them."""
+
+    def __init__(self):
+        # client order id -> (exchange, order)
+        self.orders = {}
+        self.order_id = 0
+
+    def on_instruction(self, message):
+        msg_type = message['msg_type']
+        if msg_type == MessageType.CREATE_ORDER.value:
+            return self._create_order(message)
+        elif msg_type == MessageType.CANCEL_ORDER.value:
+            client_order_id = message['data']['params']['clientOrderId']
+            if client_order_id not in self.orders:
+                return [_message(MessageType.CANCEL_ORDER_REJECT, message['exchange'], message['symbol'],
+                                 message['data'])]
+            return [self._close(client_order_id, 'canceled', message['msg_time'])]
+        elif msg_type == MessageType.CANCEL_ALL_ORDER.value:
+            return [self._close(client_order_id, 'canceled', message['msg_time'])
+                    for client_order_id, (exchange, order) in list(self.orders.items())
+                    if exchange == message['exchange'] and order['symbol'] == message['symbol']]
+        return []
+
+    def on_market_data(self, message):
+        if message['msg_type'] != MessageType.ORDER_BOOK.value:
+            return []
+        bids = message['data']['bids']
+        asks = message['data']['asks']
+        fills = []
+        for client_order_id, (exchange, order) in list(self.orders.items()):
+            if exchange != message['exchange'] or order['symbol'] != message['symbol']:
+                continue
+            if ((order['side'] == 'BUY' and asks and asks[0][0] <= order['price']) or
+                    (order['side'] == 'SELL' and bids and bids[0][0] >= order['price'])):
+                order['filled'] = order['amount']
+                order['remaining'] = 0
+                fills.append(self._close(client_order_id, 'closed', message['msg_time']))
+                fills.append(_message(MessageType.TRADE_EXECUTION, exchange, order['symbol'], {
+                    'id': order['id'],
+                    'order': order['id'],
+                    'timestamp': message['msg_time'] // 1_000_000,
+                    'symbol': order['symbol'],
+                    'side': order['side'].lower(),
+                    'price': order['price'],
+                    'amount': order['amount']
+                }))
+        return fills
+
+    def _create_order(self, message):
+        data = message['data']
+        self.order_id += 1
+        order = {
+            'id': str(self.order_id),
+            'clientOrderId': data['params']['clientOrderId'],
+            'timestamp': message['msg_time'] // 1_000_000,
+            'symbol': message['symbol'],
+            'type': data['type'],
+            'side': data['side'].upper(),
+            'price': data['price'],
+            'amount': data['amount'],
+            'filled': 0,
+            'remaining': data['amount'],
+            'status': 'open',
+            'postOnly': data['params'].get('postOnly', False)
+        }
+        self.orders[order['clientOrderId']] = (message['exchange'], order)
+        return [_message(MessageType.ORDER_UPDATE, message['exchange'], order['symbol'], dict(order))]
+
+    def _close(self, client_order_id, status, msg_time):
+        exchange, order = self.orders.pop(client_order_id)
+        order['status'] = status
+        order['lastUpdateTimestamp'] = msg_time // 1_000_000
+        return _message(MessageType.ORDER_UPDATE, exchange, order['symbol'], dict(order))
+
+
+def _message(msg_type, exchange, symbol, data):
+    return {
+        'msg_type': msg_type.value,
+        'exchange': exchange,
+        'symbol': symbol,
+        'data': data
+    }
+
+
+class Backtest:
+    """Replays recorded messages straight into a Strategy in-process, bypassing ZeroMQ and the sequencer.
+
+    Messages are delivered in the sequencer's order: each recorded message, then the replies it triggered and the
+    lifecycle messages the fill simulator produced for them, all stamped with the msg_time that caused them.
+    """
+
+    def __init__(self, strategy, reader, fill_simulator=None, msg_types=(MessageType.ORDER_BOOK.value,)):
+        self.strategy = strategy
+        self.reader = reader
+        self.fill_simulator = fill_simulator or FillSimulator()
+        # Only market data is replayed, recorded instructions and order updates belong to the recorded run
+        self.msg_types = set(msg_types)
+        self.subscription = Subscription(**(strategy.subscription() or {}))
+        self.replies = []
+        self.message_count = 0
+
+    def run(self, start_ns, end_ns):
+        message_queue = deque()
+        for recorded_message in self.reader.read(start_ns, end_ns):
+            if recorded_message.get('msg_type') not in self.msg_types:
+                continue
+            message_queue.append(recorded_message)
+            while len(message_queue) > 0:
+                message = message_queue.popleft()
+                self.message_count += 1
+                for simulated_message in self.fill_simulator.on_market_data(message):
+                    simulated_message['msg_time'] = message['msg_time']
+                    message_queue.append(simulated_message)
+                if self.subscription.matches(message['msg_type'], message.get('exchange'), message.get('symbol')):
+                    for reply in self.strategy.process_request(message):
+                        reply['msg_time'] = message['msg_time']
+                        self.replies.append(reply)
+                        message_queue.append(reply)
+                        for simulated_message in self.fill_simulator.on_instruction(reply):
+                            simulated_message['msg_time'] = message['msg_time']
+                            message_queue.append(simulated_message)
+        return self.replies
+
+
+def _parse_time_ns(value):
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()) * 1_000_000_000 + dt.microsecond * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest a strategy against recorded message logs")
+    parser.add_argument('--strategy', type=str, required=True,
+                        help='Strategy class as module:Class, e.g. strategy.opti_trade:OptiTrade')
+    parser.add_argument('--config', type=str, help='Path to the strategy configuration file', required=True)
+    parser.add_argument('--log-path', type=str, help='Directory holding the recorded message logs', required=True)
+    parser.add_argument('--log-filename', type=str, help='Base filename of the recorded message logs',
+                        default='message_log')
+    parser.add_argument('--start', type=str, help='Start time in ISO format, UTC unless an offset is given',
+                        required=True)
+    parser.add_argument('--end', type=str, help='End time in ISO format, UTC unless an offset is given', required=True)
+    args = parser.parse_args()
+
+    module_name, class_name = args.strategy.split(':')
+    strategy_class = getattr(importlib.import_module(module_name), class_name)
+    backtest = Backtest(strategy_class(args.config), DailyGzipJsonReader(args.log_path, args.log_filename),
+                        TopOfBookFillSimulator())
+    replies = backtest.run(_parse_time_ns(args.start), _parse_time_ns(args.end))
+    logging.getLogger('Backtest').info(f"Replayed {backtest.message_count} messages, "
+                                       f"strategy sent {len(replies)} instructions")
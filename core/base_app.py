@@ -20,6 +20,7 @@ class MessageType(Enum):
     CONNECT = 'connect'
     DISCONNECT = 'disconnect'
     ORDER_BOOK = 'order_book'
+    ORDER_BOOK_UPDATE = 'order_book_update'
     CREATE_ORDER = 'create_order'
     CREATE_ORDER_REJECT = 'create_order_reject'
     CANCEL_ORDER = 'cancel_order'
@@ -27,6 +28,79 @@ class MessageType(Enum):
     CANCEL_ALL_ORDER = 'cancel_all_order'
     ORDER_UPDATE = 'order_update'
     TRADE_EXECUTION = 'trade_execution'
+    STRATEGY_LAGGING = 'strategy_lagging'
+    STRATEGY_RECOVERED = 'strategy_recovered'
+    STRATEGY_EVICTED = 'strategy_evicted'
+
+
+# Sequencer notices about a strategy missing its reply deadline, always delivered to the strategy concerned
+STRATEGY_EVENT_TYPES = (MessageType.STRATEGY_LAGGING.value, MessageType.STRATEGY_RECOVERED.value,
+                        MessageType.STRATEGY_EVICTED.value)
+
+
+class Envelope:
+    """A message on the wire: a small msgpack header frame followed by the msgpack payload frame.
+
+    The header holds [msg_type, exchange, symbol, seq, msg_time], which is all the sequencer needs to route and
+    stamp a message, so the payload bytes are passed through untouched. A single frame is a message from an app
+    that still sends the whole message as one msgpack blob; it is decoded once to build the header. On the PUB
+    socket a topic frame goes first, see topic().
+    """
+    __slots__ = ('msg_type', 'exchange', 'symbol', 'seq', 'msg_time', 'payload')
+
+    def __init__(self, msg_type, exchange, symbol, seq, msg_time, payload):
+        self.msg_type = msg_type
+        self.exchange = exchange
+        self.symbol = symbol
+        self.seq = seq
+        self.msg_time = msg_time
+        self.payload = payload
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(message.get('msg_type'), message.get('exchange'), message.get('symbol'),
+                   message.get('seq'), message.get('msg_time'), msgpack.packb(message))
+
+    @classmethod
+    def from_frames(cls, frames):
+        if len(frames) == 3:
+            # Published with a topic frame ahead of the header
+            frames = frames[1:]
+        if len(frames) == 1:
+            message = msgpack.unpackb(frames[0], raw=False)
+            return cls(message.get('msg_type'), message.get('exchange'), message.get('symbol'),
+                       message.get('seq'), message.get('msg_time'), frames[0])
+        return cls(*msgpack.unpackb(frames[0], raw=False), frames[1])
+
+    def topic(self):
+        # "msg_type|exchange|symbol|", so a subscriber filters on any leading part, e.g. "create_order|CDC|"
+        return f"{self.msg_type}|{self.exchange or ''}|{self.symbol or ''}|".encode()
+
+    def frames(self):
+        return [msgpack.packb([self.msg_type, self.exchange, self.symbol, self.seq, self.msg_time]), self.payload]
+
+    def unpack(self):
+        message = msgpack.unpackb(self.payload, raw=False)
+        if self.seq is not None:
+            message['seq'] = self.seq
+        if self.msg_time is not None:
+            message['msg_time'] = self.msg_time
+        return message
+
+
+class Subscription:
+    """Routing filter a strategy declares on CONNECT; a field left out matches everything."""
+
+    def __init__(self, exchange=None, symbols=None, msg_types=None):
+        self.exchange = exchange
+        self.symbols = set(symbols) if symbols else None
+        self.msg_types = set(msg_types) if msg_types else None
+
+    def matches(self, msg_type, exchange, symbol):
+        # Messages that carry no exchange or symbol cannot be filtered on it
+        return ((self.msg_types is None or msg_type in self.msg_types) and
+                (self.exchange is None or exchange is None or exchange == self.exchange) and
+                (self.symbols is None or symbol is None or symbol in self.symbols))
 
 
 class BaseApp(ABC):
@@ -110,7 +184,8 @@ class BaseApp(ABC):
     async def stop(self):
         await self.pre_stop()
 
-        for task in self.tasks:
+        # Copied, as tasks may remove themselves from the set once done
+        for task in list(self.tasks):
             task.cancel()
             try:
                 await task
@@ -130,4 +205,4 @@ class BaseApp(ABC):
     @final
     async def send(self, message):
         if self.publisher_socket:
-            await self.publisher_socket.send(msgpack.packb(message))
+            await self.publisher_socket.send_multipart(Envelope.from_message(message).frames())
@@ -1,17 +1,216 @@
-import aiohttp
 import argparse
 import asyncio
-import ccxt.pro
 import hashlib
 import hmac
+import itertools
 import json
-import math
+import multiprocessing
 import os
 import time
 import websockets
-from base_app import MessageType
+from base_app import BaseApp, MessageType
+from cdc_instruments import InstrumentCache, InstrumentFormatter
+from cdc_parser import loads, parse_levels, parse_order_book, parse_orders
 from dotenv import load_dotenv
+from metrics import LatencyHistogram
+from order_book import OrderBook
 from proxy_app import ProxyApp
+from rate_limiter import CANCEL, NEW, RateLimiter
+
+# Most orders CDC accepts in one create-order-list or cancel-order-list request
+MAX_ORDER_LIST = 10
+
+# Order entry methods whose responses are matched to their request, and what a failed order turns into
+ORDER_METHODS = {
+    'private/create-order': MessageType.CREATE_ORDER_REJECT,
+    'private/create-order-list': MessageType.CREATE_ORDER_REJECT,
+    'private/cancel-order': MessageType.CANCEL_ORDER_REJECT,
+    'private/cancel-order-list': MessageType.CANCEL_ORDER_REJECT
+}
+
+
+class MarketDataShard:
+    """One market data websocket and the order books of the instruments assigned to it.
+
+    Lag is the time from a book's exchange timestamp to its arrival on the websocket, processing the time from
+    arrival until the book has been pushed to the sequencer. Both are logged per shard every stats interval.
+    """
+
+    def __init__(self, app, shard_id, instruments):
+        self.app = app
+        self.shard_id = shard_id
+        self.instruments = instruments
+        self.logger = app.logger
+        self.name = f"{app.app_name} shard {shard_id}"
+        self.exchange_id = app.config['Instrument']['exchange']
+        self.book_depth = int(app.config['Instrument']['book_depth'])
+        # SNAPSHOT publishes every full book from the exchange, SNAPSHOT_AND_UPDATE maintains books from deltas
+        self.book_subscription_type = app.config['Instrument'].get('book_subscription_type', 'SNAPSHOT')
+        self.book_update_frequency = app.config['Instrument'].get('book_update_frequency', '10')
+        # With deltas, publish the whole book ('full') or only the levels that changed ('delta')
+        self.book_publish = app.config['Instrument'].get('book_publish', 'full')
+        self.order_books = {instrument: OrderBook(instrument, self.book_depth) for instrument in instruments}
+        self.websocket = None
+        self.message_count = 0
+        self.lag = LatencyHistogram()
+        self.processing = LatencyHistogram()
+
+    async def connect(self):
+        market_url = self.app.config['API']['market_url']
+        self.websocket = await websockets.connect(market_url)
+        self.logger.info(f"{self.name} - Connected to market data WebSocket at {market_url}")
+        await self.subscribe()
+
+    async def close(self):
+        if self.websocket:
+            await self.websocket.close()
+
+    async def subscribe(self, instruments=None, method="subscribe"):
+        channels = ",".join([f"book.{instrument}.{self.book_depth}" for instrument in instruments or self.instruments])
+        order_book_payload = {
+            "id": int(time.time() * 1000),
+            "method": method,
+            "params": {
+                "channels": channels
+            }
+        }
+        if self.book_subscription_type != 'SNAPSHOT' and method == "subscribe":
+            order_book_payload["params"]["book_subscription_type"] = self.book_subscription_type
+            order_book_payload["params"]["book_update_frequency"] = int(self.book_update_frequency)
+        order_book_payload_json = json.dumps(order_book_payload)
+        self.logger.info(
+            f"{self.name} - Sending subscribe request for market channels with payload: {order_book_payload_json}")
+        await self.websocket.send(order_book_payload_json)
+        self.logger.info(f"{self.name} - Subscribed to market channels: {channels}")
+
+    async def market_data_handler(self):
+        while not self.app.shutdown_event.is_set():
+            try:
+                market_response = await self.websocket.recv()
+                receive_time = time.perf_counter_ns()
+                self.logger.debug(f"{self.name} - Received market data: {market_response}")
+                market_message = loads(market_response)
+                if 'method' in market_message:
+                    method = market_message['method']
+                    if method == 'public/heartbeat':
+                        await handle_heartbeat(self.websocket, market_message, self.logger, self.name)
+                    elif method == 'subscribe':
+                        if 'result' in market_message:
+                            result = market_message['result']
+                            data0 = result['data'][0]
+                            self.message_count += 1
+                            self.lag.record(max(time.time_ns() - data0['t'] * 1_000_000, 0))
+                            if result['channel'] == 'book' and self.book_subscription_type != 'SNAPSHOT':
+                                await self.handle_book_snapshot(result['instrument_name'], data0)
+                            elif result['channel'] == 'book':
+                                instrument_name = result['instrument_name']
+                                order_book = parse_order_book(data0, instrument_name)
+                                self.logger.debug(
+                                    f"{self.name} - Sending order book for {instrument_name}: {order_book}")
+                                message = {
+                                    'msg_type': MessageType.ORDER_BOOK.value,
+                                    'exchange': self.exchange_id,
+                                    'symbol': instrument_name,
+                                    'data': order_book
+                                }
+                                await self.app.send(message)
+                            elif result['channel'] == 'book.update':
+                                await self.handle_book_update(result['instrument_name'], data0)
+                            self.processing.record(time.perf_counter_ns() - receive_time)
+            except Exception as e:
+                self.logger.error(f"{self.name} - An unexpected error occurred with market data WebSocket: {e}")
+
+    async def handle_book_snapshot(self, instrument_name, data):
+        order_book = self.order_books[instrument_name]
+        order_book.apply_snapshot(parse_levels(data['bids']), parse_levels(data['asks']), data['u'], data['t'])
+        await self.send_order_book(order_book)
+
+    async def handle_book_update(self, instrument_name, data):
+        order_book = self.order_books[instrument_name]
+        if not order_book.synced:
+            # Waiting for the snapshot after subscribing or after a gap
+            return
+        update = data['update']
+        changes = order_book.apply_update(parse_levels(update.get('bids', [])), parse_levels(update.get('asks', [])),
+                                          data['u'], data.get('pu'), data['t'])
+        if changes is None:
+            # A missed delta leaves the book wrong until a new snapshot arrives
+            self.logger.warning(f"{self.name} - Book sequence gap for {instrument_name} at {data['u']}, "
+                                f"resubscribing for a snapshot")
+            await self.subscribe([instrument_name], method="unsubscribe")
+            await self.subscribe([instrument_name])
+            return
+        changed_bids, changed_asks = changes
+        if not changed_bids and not changed_asks:
+            return
+        if self.book_publish == 'delta':
+            message = {
+                'msg_type': MessageType.ORDER_BOOK_UPDATE.value,
+                'exchange': self.exchange_id,
+                'symbol': instrument_name,
+                'data': {
+                    'symbol': instrument_name,
+                    'bids': changed_bids,
+                    'asks': changed_asks,
+                    'timestamp': data['t'],
+                    'nonce': data['u'],
+                    'prev_nonce': data.get('pu')
+                }
+            }
+            await self.app.send(message)
+        else:
+            await self.send_order_book(order_book)
+
+    async def send_order_book(self, order_book):
+        message = {
+            'msg_type': MessageType.ORDER_BOOK.value,
+            'exchange': self.exchange_id,
+            'symbol': order_book.symbol,
+            'data': order_book.to_dict()
+        }
+        await self.app.send(message)
+
+    async def report_statistics(self, interval):
+        while not self.app.shutdown_event.is_set():
+            await asyncio.sleep(interval)
+            self.log_statistics()
+
+    def log_statistics(self):
+        self.logger.info(f"{self.name} - {len(self.instruments)} instruments, {self.message_count} messages, "
+                         f"lag: {self.lag.summary()}, processing: {self.processing.summary()}")
+        self.message_count = 0
+        self.lag.reset()
+        self.processing.reset()
+
+
+class CdcMarketDataShardApp(BaseApp):
+    """Runs one market data shard in its own process, pushing to the gateway's sequencer endpoint."""
+
+    def __init__(self, config_file, shard_id):
+        super().__init__(config_file)
+        self.app_name = f"{self.app_name}-{shard_id}"
+        instruments = split_instruments(self.config)
+        self.shard = MarketDataShard(self, shard_id, instruments[shard_id])
+        self.stats_interval = self.config.getint('Instrument', 'stats_interval_sec', fallback=60)
+
+    async def post_start(self):
+        await self.shard.connect()
+        task1 = asyncio.create_task(self.shard.market_data_handler())
+        task2 = asyncio.create_task(self.shard.report_statistics(self.stats_interval))
+        self.tasks.update({task1, task2})
+
+    async def pre_stop(self):
+        await self.shard.close()
+
+
+class InFlightRequest:
+    """An order entry request awaiting its response, with its orders as (instrument_name, client_oid, order_id)."""
+    __slots__ = ('method', 'orders', 'send_time')
+
+    def __init__(self, method, orders, send_time):
+        self.method = method
+        self.orders = orders
+        self.send_time = send_time
 
 
 class CdcGateway(ProxyApp):
@@ -23,37 +222,48 @@ class CdcGateway(ProxyApp):
         self.exchange_id = self.config['Instrument']['exchange']
         self.instruments = [instrument.strip() for instrument in self.config['Instrument']['instruments'].split(',')]
         self.instruments_map = None
-        self.market_websocket = None
+        self.formatters = {}
+        self.instrument_cache = InstrumentCache(
+            self.config.get('Instrument', 'instrument_cache_path', fallback='/tmp/cdc_gateway/instruments.json'),
+            self.config['API']['rest_endpoint_prefix'],
+            self.config.getint('Instrument', 'instrument_cache_ttl_sec', fallback=3600), self.logger, self.app_name)
+        self.instrument_cache.add_listener(self.update_instruments)
+        self.config_file = config
+        # Market data is split over shards, each with its own websocket, run as tasks here or as worker processes
+        self.shard_processes = self.config.getboolean('Instrument', 'shard_processes', fallback=False)
+        self.stats_interval = self.config.getint('Instrument', 'stats_interval_sec', fallback=60)
+        self.shards = []
+        self.shard_workers = []
         self.user_websocket = None
-        # use for message parsing
-        self.exchange = ccxt.pro.cryptocom()
+        # Instructions arriving within the window go out together on the list endpoints, 0 sends each at once
+        self.batch_window_ms = self.config.getint('OrderEntry', 'batch_window_ms', fallback=0)
+        self.max_batch_size = min(self.config.getint('OrderEntry', 'max_batch_size', fallback=10), MAX_ORDER_LIST)
+        self.pending_creates = []
+        self.pending_cancels = []
+        self.batch_task = None
+        # client_oid -> (instrument_name, order_id) of open orders, as cancel lists need both
+        self.open_orders = {}
+        # Request ids count up from the start time, unique within a run and unlikely to repeat across restarts
+        self.request_ids = itertools.count(int(time.time() * 1000))
+        # request id -> InFlightRequest until its response arrives or it is given up after ack_timeout_ms
+        self.in_flight = {}
+        self.ack_timeout_ms = self.config.getint('OrderEntry', 'ack_timeout_ms', fallback=5000)
+        self.ack_latency = {method: LatencyHistogram() for method in ORDER_METHODS}
+        self.ack_timeouts = dict.fromkeys(ORDER_METHODS, 0)
+        # Request budget per websocket method; no section means no limit
+        self.rate_limiter = (RateLimiter.from_config(self.config['RateLimit'])
+                             if self.config.has_section('RateLimit') else RateLimiter({}))
+        # client_oid -> (instrument_name, task) of a create waiting for the budget, so a cancel can drop it
+        self.waiting_creates = {}
 
     async def post_start(self):
         await super().post_start()
 
-        # Call REST API to get instruments
-        rest_endpoint_prefix = self.config['API']['rest_endpoint_prefix']
-        instruments_url = rest_endpoint_prefix + "public/get-instruments"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(instruments_url) as response:
-                if response.status == 200:
-                    instruments_data = await response.json()
-                    if instruments_data.get("code") == 0:
-                        self.instruments_map = {
-                            instrument["symbol"]: instrument
-                            for instrument in instruments_data["result"]["data"]
-                        }
-                        self.logger.info(f"{self.app_name} - Instruments map updated.")
-                    else:
-                        self.logger.error(
-                            f"{self.app_name} - Failed to get instruments: {instruments_data.get('message')}")
-                else:
-                    self.logger.error(f"{self.app_name} - Failed to get instruments, HTTP status: {response.status}")
-
-        market_url = self.config['API']['market_url']
-        self.market_websocket = await websockets.connect(market_url)
-        self.logger.info(f"{self.app_name} - Connected to market data WebSocket at {market_url}")
-        await self.subscribe_to_market_channels()
+        # Instruments come from the on-disk cache when there is one, REST is only awaited without it
+        await self.instrument_cache.load()
+        self.tasks.add(asyncio.create_task(self.instrument_cache.refresh_periodically(self.shutdown_event)))
+
+        await self.start_shards()
 
         user_url = self.config['API']['user_url']
         self.user_websocket = await websockets.connect(user_url)
@@ -62,34 +272,64 @@ class CdcGateway(ProxyApp):
         await self.subscribe_to_user_channels()
 
         task1 = asyncio.create_task(self.command_message_handler())
-        task2 = asyncio.create_task(self.market_data_handler())
-        task3 = asyncio.create_task(self.user_data_handler())
-        self.tasks.update({task1, task2, task3})
+        task2 = asyncio.create_task(self.user_data_handler())
+        task3 = asyncio.create_task(self.expire_in_flight())
+        task4 = asyncio.create_task(self.report_statistics())
+        self.tasks.update({task1, task2, task3, task4})
+
+    def update_instruments(self, instruments_map):
+        self.instruments_map = instruments_map
+        self.formatters = {symbol: InstrumentFormatter(instrument) for symbol, instrument in instruments_map.items()}
+
+    async def start_shards(self):
+        shard_instruments = split_instruments(self.config)
+        if self.shard_processes:
+            # Spawned rather than forked, the parent already holds a ZeroMQ context
+            context = multiprocessing.get_context('spawn')
+            for shard_id in range(len(shard_instruments)):
+                worker = context.Process(target=run_market_data_shard, args=(self.config_file, shard_id),
+                                         name=f"{self.app_name}-{shard_id}", daemon=True)
+                worker.start()
+                self.shard_workers.append(worker)
+                self.logger.info(f"{self.app_name} - Started market data shard {shard_id} in process {worker.pid} "
+                                 f"for {shard_instruments[shard_id]}")
+            self.tasks.add(asyncio.create_task(self.monitor_shard_workers()))
+        else:
+            for shard_id, instruments in enumerate(shard_instruments):
+                shard = MarketDataShard(self, shard_id, instruments)
+                await shard.connect()
+                self.shards.append(shard)
+                self.tasks.add(asyncio.create_task(shard.market_data_handler()))
+                self.tasks.add(asyncio.create_task(shard.report_statistics(self.stats_interval)))
+
+    async def monitor_shard_workers(self):
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(1)
+            for worker in self.shard_workers:
+                if not worker.is_alive():
+                    # Books for the shard's instruments have stopped, let the process manager restart the gateway
+                    self.logger.error(f"{self.app_name} - Market data shard {worker.name} exited with code "
+                                      f"{worker.exitcode}, shutting down")
+                    self.shutdown_event.set()
+                    return
 
     async def pre_stop(self):
-        await self.exchange.close()
-        if self.market_websocket:
-            await self.market_websocket.close()
+        for shard in self.shards:
+            await shard.close()
+        for worker in self.shard_workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self.shard_workers:
+            worker.join(timeout=5)
+        if self.pending_creates:
+            self.logger.warning(f"{self.app_name} - Dropping {len(self.pending_creates)} batched creates on shutdown")
+            self.pending_creates = []
+        if self.pending_cancels and self.user_websocket:
+            await self.flush_batch()
         if self.user_websocket:
             await self.user_websocket.close()
         await super().pre_stop()
 
-    async def subscribe_to_market_channels(self):
-        book_depth = self.config['Instrument']['book_depth']
-        channels = ",".join([f"book.{instrument}.{book_depth}" for instrument in self.instruments])
-        order_book_payload = {
-            "id": int(time.time() * 1000),
-            "method": "subscribe",
-            "params": {
-                "channels": channels
-            }
-        }
-        order_book_payload_json = json.dumps(order_book_payload)
-        self.logger.info(
-            f"{self.app_name} - Sending subscribe request for market channels with payload: {order_book_payload_json}")
-        await self.market_websocket.send(order_book_payload_json)
-        self.logger.info(f"{self.app_name} - Subscribed to market channels: {channels}")
-
     async def authenticate_user_websocket(self):
         nonce = int(time.time() * 1000)
         method = 'public/auth'
@@ -108,7 +348,7 @@ class CdcGateway(ProxyApp):
         await self.user_websocket.send(auth_payload_json)
         auth_response = await self.user_websocket.recv()
         self.logger.info(f"{self.app_name} - Received authentication response: {auth_response}")
-        auth_message = json.loads(auth_response)
+        auth_message = loads(auth_response)
         if auth_message.get('code') == 0:
             self.user_websocket.authenticated = True
         else:
@@ -121,7 +361,7 @@ class CdcGateway(ProxyApp):
             raise Exception("Cannot subscribe to user channels without successful authentication.")
         channels = ["user.order"]
         user_channels_payload = {
-            "id": int(time.time() * 1000),
+            "id": next(self.request_ids),
             "method": "subscribe",
             "params": {
                 "channels": channels
@@ -133,69 +373,36 @@ class CdcGateway(ProxyApp):
         await self.user_websocket.send(user_channels_payload_json)
         self.logger.info(f"{self.app_name} - Subscribed to user channels: {channels}")
 
-    async def market_data_handler(self):
-        while not self.shutdown_event.is_set():
-            try:
-                market_response = await self.market_websocket.recv()
-                self.logger.debug(f"{self.app_name} - Received market data: {market_response}")
-                market_message = json.loads(market_response)
-                if 'method' in market_message:
-                    method = market_message['method']
-                    if method == 'public/heartbeat':
-                        await self.handle_heartbeat(self.market_websocket, market_message)
-                    elif method == 'subscribe':
-                        if 'result' in market_message:
-                            result = market_message['result']
-                            if result['channel'] == 'book':
-                                instrument_name = result['instrument_name']
-                                data0 = result['data'][0]
-                                order_book = self.exchange.parse_order_book(orderbook=data0,
-                                                                            symbol=instrument_name,
-                                                                            timestamp=data0['t'])
-                                self.logger.debug(
-                                    f"{self.app_name} - Sending order book for {instrument_name}: {order_book}")
-                                message = {
-                                    'msg_type': MessageType.ORDER_BOOK.value,
-                                    'exchange': self.exchange_id,
-                                    'symbol': instrument_name,
-                                    'data': order_book
-                                }
-                                await self.send(message)
-            except Exception as e:
-                self.logger.error(f"{self.app_name} - An unexpected error occurred with market data WebSocket: {e}")
-
     async def user_data_handler(self):
         while not self.shutdown_event.is_set():
             try:
                 user_response = await self.user_websocket.recv()
                 self.logger.info(f"{self.app_name} - Received user data: {user_response}")
-                user_message = json.loads(user_response)
+                user_message = loads(user_response)
                 if 'method' in user_message:
                     method = user_message['method']
                     if method == 'public/heartbeat':
-                        await self.handle_heartbeat(self.user_websocket, user_message)
-                    elif method == 'private/create-order':
-                        if user_message['code'] != 0:
-                            self.logger.error(
-                                f"{self.app_name} - create order reject for {user_message['result']['client_oid']}")
-                            reject_message = {
-                                'msg_type': MessageType.CREATE_ORDER_REJECT.value,
-                                'exchange': self.exchange_id,
-                                'data': {'params': {'clientOrderId': user_message['result']['client_oid']}}
-                            }
-                            await self.send(reject_message)
+                        await handle_heartbeat(self.user_websocket, user_message, self.logger, self.app_name)
+                    elif method in ORDER_METHODS:
+                        await self.handle_order_response(user_message)
                     elif method == 'subscribe':
                         if 'result' in user_message:
                             result = user_message['result']
                             if result['channel'].startswith('user.order'):
-                                orders = self.exchange.parse_orders(orders=result['data'])
+                                orders = parse_orders(result['data'])
                                 for order in orders:
+                                    if order['status'] == 'open':
+                                        self.open_orders[order['clientOrderId']] = (order['info']['instrument_name'],
+                                                                                    order['id'])
+                                    else:
+                                        self.open_orders.pop(order['clientOrderId'], None)
                                     self.logger.info(
                                         f"{self.app_name} - sending order update for {order['symbol']}[{order['clientOrderId']}]")
+                                    # Route on the instrument name, as order books are, rather than the unified symbol
                                     message = {
                                         'msg_type': MessageType.ORDER_UPDATE.value,
                                         'exchange': self.exchange_id,
-                                        'symbol': order['symbol'],
+                                        'symbol': order['info']['instrument_name'],
                                         'data': order
                                     }
                                     await self.send(message)
@@ -203,15 +410,6 @@ class CdcGateway(ProxyApp):
             except Exception as e:
                 self.logger.error(f"{self.app_name} - An unexpected error occurred with user data WebSocket: {e}")
 
-    async def handle_heartbeat(self, websocket, message):
-        self.logger.debug(f"{self.app_name} - Received heartbeat message: {message}")
-        if 'id' in message:
-            await websocket.send(json.dumps({
-                "id": message['id'],
-                "method": "public/respond-heartbeat"
-            }))
-        self.logger.debug(f"{self.app_name} - Responded to heartbeat with message ID: {message['id']}")
-
     async def command_message_handler(self):
         while not self.shutdown_event.is_set():
             message = await self.receive()
@@ -224,41 +422,87 @@ class CdcGateway(ProxyApp):
                     await self.cancel_order(**message['data'])
 
     async def create_order(self, symbol, side, type, price, amount, params):
-        instrument = self.instruments_map[symbol]
-        price_tick_size = float(instrument['price_tick_size'])
-        qty_tick_size = float(instrument['qty_tick_size'])
+        formatter = self.formatters[symbol]
         side = side.upper()
-        if side == 'BUY':
-            price = math.floor(price / price_tick_size) * price_tick_size
-        elif side == 'SELL':
-            price = math.ceil(price / price_tick_size) * price_tick_size
-        amount = math.floor(amount / qty_tick_size) * qty_tick_size
-
         client_order_id = params["clientOrderId"]
         exec_inst = ["POST_ONLY"] if params.get("postOnly") else []
+        order_params = {
+            "instrument_name": symbol,
+            "side": side,
+            "type": type.upper(),
+            "price": formatter.format_price(price, side),
+            "quantity": formatter.format_quantity(amount),
+            "client_oid": client_order_id,
+            "exec_inst": exec_inst
+        }
+        if self.batch_window_ms > 0:
+            self.pending_creates.append((order_params, self.virtual_time))
+            await self.schedule_batch()
+        else:
+            await self.send_create_order(order_params, self.virtual_time)
+
+    async def send_create_order(self, order_params, issued_ns):
+        if self.rate_limiter.try_acquire("private/create-order"):
+            await self.write_create_order(order_params)
+            return
+        # Wait for the budget off the command loop, so instructions behind it are not held up
+        client_order_id = order_params["client_oid"]
+        task = asyncio.create_task(self.send_create_order_when_allowed(order_params, issued_ns))
+        self.waiting_creates[client_order_id] = (order_params["instrument_name"], task)
+        task.add_done_callback(lambda _: self.waiting_creates.pop(client_order_id, None))
+
+    async def send_create_order_when_allowed(self, order_params, issued_ns):
+        if await self.rate_limiter.acquire("private/create-order", NEW, issued_ns):
+            await self.write_create_order(order_params)
+        else:
+            self.logger.warning(f"{self.app_name} - Shed create order {order_params['client_oid']}, "
+                                f"over the request budget")
+            await self.send_reject(MessageType.CREATE_ORDER_REJECT, order_params["instrument_name"],
+                                   order_params["client_oid"])
+
+    async def write_create_order(self, order_params):
         order_payload = {
-            "id": int(time.time() * 1000),
+            "id": self.track_request("private/create-order",
+                                     [(order_params["instrument_name"], order_params["client_oid"], 0)]),
             "method": "private/create-order",
-            "params": {
-                "instrument_name": symbol,
-                "side": side,
-                "type": type.upper(),
-                "price": f"{price:.{instrument['quote_decimals']}f}",
-                "quantity": f"{amount:.{instrument['quantity_decimals']}f}",
-                "client_oid": client_order_id,
-                "exec_inst": exec_inst
-            }
+            "params": order_params
         }
         order_payload_json = json.dumps(order_payload)
         self.logger.info(f"{self.app_name} - Sending place order request with payload: {order_payload_json}")
         await self.user_websocket.send(order_payload_json)
-        self.logger.info(
-            f"{self.app_name} - Sent request to place new sell order with ID: {client_order_id} at price: {price}")
+        self.logger.info(f"{self.app_name} - Sent request to place new {order_params['side']} order with ID: "
+                         f"{order_params['client_oid']} at price: {order_params['price']}")
+
+    async def drop_waiting_create(self, client_order_id):
+        waiting_create = self.waiting_creates.pop(client_order_id, None)
+        if waiting_create is None:
+            return False
+        # The create never went out, so neither does the cancel
+        instrument_name, task = waiting_create
+        if task is not None:
+            task.cancel()
+        self.logger.info(f"{self.app_name} - Dropped create order {client_order_id} waiting for budget")
+        await self.send_reject(MessageType.CREATE_ORDER_REJECT, instrument_name, client_order_id)
+        return True
 
     async def cancel_order(self, id=0, params={}):
+        if await self.drop_waiting_create(params.get('clientOrderId')):
+            return
+        if self.batch_window_ms > 0:
+            # Queued even when it cannot be batched, so it never overtakes a create still waiting in the window
+            self.pending_cancels.append((id, params))
+            await self.schedule_batch()
+        else:
+            await self.send_cancel_order(id, params)
+
+    async def send_cancel_order(self, id=0, params={}):
+        await self.rate_limiter.acquire("private/cancel-order", CANCEL)
+        client_order_id = params.get('clientOrderId')
+        instrument_name = self.open_orders.get(client_order_id, (None,))[0]
+        request_id = self.track_request("private/cancel-order", [(instrument_name, client_order_id, id)])
         if 'clientOrderId' in params:
             cancel_payload = {
-                "id": int(time.time() * 1000),
+                "id": request_id,
                 "method": "private/cancel-order",
                 "params": {
                     "client_oid": params['clientOrderId']
@@ -266,7 +510,7 @@ class CdcGateway(ProxyApp):
             }
         else:
             cancel_payload = {
-                "id": int(time.time() * 1000),
+                "id": request_id,
                 "method": "private/cancel-order",
                 "params": {
                     "order_id": id
@@ -276,6 +520,179 @@ class CdcGateway(ProxyApp):
         self.logger.info(f"{self.app_name} - Sending cancel order request with payload: {cancel_payload_json}")
         await self.user_websocket.send(cancel_payload_json)
 
+    async def schedule_batch(self):
+        if len(self.pending_creates) >= self.max_batch_size or len(self.pending_cancels) >= self.max_batch_size:
+            await self.flush_batch()
+        elif self.batch_task is None:
+            self.batch_task = asyncio.create_task(self.flush_batch_later())
+
+    async def flush_batch_later(self):
+        await asyncio.sleep(self.batch_window_ms / 1000)
+        self.batch_task = None
+        await self.flush_batch()
+
+    async def flush_batch(self):
+        # Creates go first so a cancel for an order created in the same window reaches the exchange after it
+        creates, self.pending_creates = self.pending_creates, []
+        cancels, self.pending_cancels = self.pending_cancels, []
+        for start in range(0, len(creates), self.max_batch_size):
+            chunk = creates[start:start + self.max_batch_size]
+            if len(chunk) == 1:
+                await self.send_create_order(*chunk[0])
+                continue
+            if self.rate_limiter.try_acquire("private/create-order-list"):
+                await self.send_create_order_list(chunk)
+                continue
+            # Wait for the budget off the command loop, as a single create does; a cancel drops its order from the
+            # list while it waits
+            task = asyncio.create_task(self.send_create_order_list_when_allowed(chunk))
+            for order, issued_ns in chunk:
+                self.waiting_creates[order["client_oid"]] = (order["instrument_name"], None)
+            task.add_done_callback(lambda _, chunk=chunk: [self.waiting_creates.pop(order["client_oid"], None)
+                                                            for order, issued_ns in chunk])
+
+        # Cancel lists address orders by instrument and order id, known once the order has been acknowledged
+        cancel_orders = []
+        for id, params in cancels:
+            client_order_id = params.get('clientOrderId')
+            if await self.drop_waiting_create(client_order_id):
+                continue
+            if client_order_id in self.open_orders:
+                instrument_name, order_id = self.open_orders[client_order_id]
+                cancel_orders.append((instrument_name, client_order_id, order_id))
+            else:
+                await self.send_cancel_order(id, params)
+        for start in range(0, len(cancel_orders), self.max_batch_size):
+            chunk = cancel_orders[start:start + self.max_batch_size]
+            if len(chunk) == 1:
+                await self.send_cancel_order(chunk[0][2], {'clientOrderId': chunk[0][1]})
+            else:
+                await self.rate_limiter.acquire("private/cancel-order-list", CANCEL)
+                await self.send_order_list("private/cancel-order-list",
+                                           [{"instrument_name": instrument_name, "order_id": order_id}
+                                            for instrument_name, client_order_id, order_id in chunk], chunk)
+
+    async def send_create_order_list_when_allowed(self, chunk):
+        # The list is as stale as its oldest order
+        allowed = await self.rate_limiter.acquire("private/create-order-list", NEW,
+                                                  min(issued_ns or time.time_ns() for order, issued_ns in chunk))
+        # Orders cancelled while waiting are no longer in waiting_creates
+        chunk = [(order, issued_ns) for order, issued_ns in chunk
+                 if self.waiting_creates.pop(order["client_oid"], None) is not None]
+        if not allowed:
+            self.logger.warning(f"{self.app_name} - Shed create order list of {len(chunk)}, over the request budget")
+            for order, issued_ns in chunk:
+                await self.send_reject(MessageType.CREATE_ORDER_REJECT, order["instrument_name"], order["client_oid"])
+        elif len(chunk) == 1:
+            await self.write_create_order(chunk[0][0])
+        elif chunk:
+            await self.send_create_order_list(chunk)
+
+    async def send_create_order_list(self, chunk):
+        orders = [(order["instrument_name"], order["client_oid"], 0) for order, issued_ns in chunk]
+        await self.send_order_list("private/create-order-list", [order for order, issued_ns in chunk], orders)
+
+    async def send_order_list(self, method, order_list, orders):
+        order_list_payload = {
+            "id": self.track_request(method, orders),
+            "method": method,
+            "params": {
+                "contingency_type": "LIST",
+                "order_list": order_list
+            }
+        }
+        order_list_payload_json = json.dumps(order_list_payload)
+        self.logger.info(f"{self.app_name} - Sending {method} request for {len(order_list)} orders with payload: "
+                         f"{order_list_payload_json}")
+        await self.user_websocket.send(order_list_payload_json)
+
+    def track_request(self, method, orders):
+        request_id = next(self.request_ids)
+        self.in_flight[request_id] = InFlightRequest(method, orders, time.perf_counter_ns())
+        return request_id
+
+    async def handle_order_response(self, message):
+        request = self.in_flight.pop(message.get('id'), None)
+        if request is None:
+            self.logger.warning(f"{self.app_name} - Response to unknown or expired request {message.get('id')} "
+                                f"for {message['method']}")
+            return
+        self.ack_latency[request.method].record(time.perf_counter_ns() - request.send_time)
+        reject_type = ORDER_METHODS[request.method]
+        if message.get('code') != 0:
+            # A single order failed, or the whole list was refused
+            failed = range(len(request.orders))
+        elif request.method.endswith('-list'):
+            failed = [entry['index'] for entry in message['result']['result_list'] if entry.get('code', 0) != 0]
+        else:
+            failed = []
+        for index in failed:
+            instrument_name, client_order_id, order_id = request.orders[index]
+            self.logger.error(f"{self.app_name} - {reject_type.value} for {client_order_id}")
+            await self.send_reject(reject_type, instrument_name, client_order_id, order_id)
+
+    async def send_reject(self, reject_type, instrument_name, client_order_id, order_id=0):
+        data = {'params': {'clientOrderId': client_order_id}}
+        if reject_type == MessageType.CANCEL_ORDER_REJECT:
+            data['id'] = order_id
+        reject_message = {
+            'msg_type': reject_type.value,
+            'exchange': self.exchange_id,
+            'symbol': instrument_name,
+            'data': data
+        }
+        await self.send(reject_message)
+
+    async def expire_in_flight(self):
+        # A request without a response is given up, its orders' fate shows in the user.order channel
+        timeout_ns = self.ack_timeout_ms * 1_000_000
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(self.ack_timeout_ms / 1000)
+            now = time.perf_counter_ns()
+            for request_id, request in list(self.in_flight.items()):
+                if now - request.send_time > timeout_ns:
+                    del self.in_flight[request_id]
+                    self.ack_timeouts[request.method] += 1
+                    self.logger.warning(f"{self.app_name} - No response to {request.method} request {request_id} "
+                                        f"within {self.ack_timeout_ms} ms for "
+                                        f"{[client_order_id for _, client_order_id, _ in request.orders]}")
+
+    async def report_statistics(self):
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(self.stats_interval)
+            self.log_statistics()
+
+    def log_statistics(self):
+        for method, latency in self.ack_latency.items():
+            if latency.count > 0 or self.ack_timeouts[method] > 0:
+                self.logger.info(f"{self.app_name} - Ack latency for {method}: {latency.summary()}, "
+                                 f"timeouts: {self.ack_timeouts[method]}")
+                latency.reset()
+                self.ack_timeouts[method] = 0
+        for endpoint, statistics in self.rate_limiter.utilisation().items():
+            self.logger.info(f"{self.app_name} - Rate limit for {endpoint}: {statistics}")
+
+
+async def handle_heartbeat(websocket, message, logger, name):
+    logger.debug(f"{name} - Received heartbeat message: {message}")
+    if 'id' in message:
+        await websocket.send(json.dumps({
+            "id": message['id'],
+            "method": "public/respond-heartbeat"
+        }))
+    logger.debug(f"{name} - Responded to heartbeat with message ID: {message['id']}")
+
+
+def split_instruments(config):
+    # Round robin over the configured order, so every process derives the same shards from the same config
+    instruments = [instrument.strip() for instrument in config['Instrument']['instruments'].split(',')]
+    shards = max(1, min(config.getint('Instrument', 'shards', fallback=1), len(instruments)))
+    return [instruments[shard_id::shards] for shard_id in range(shards)]
+
+
+def run_market_data_shard(config_file, shard_id):
+    asyncio.run(CdcMarketDataShardApp(config_file, shard_id).run())
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the CdcGateway app with the specified configuration")
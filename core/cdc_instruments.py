@@ -0,0 +1,135 @@
+import aiohttp
+import asyncio
+import json
+import os
+import time
+
+
+class InstrumentFormatter:
+    """Rounds prices and quantities onto an instrument's tick grid in integer arithmetic and formats them.
+
+    Tick sizes are parsed once into integer tick units at a fixed scale, so the order path does one multiply and
+    integer division instead of float division against tick sizes and precision lookups.
+    """
+    __slots__ = ('price_scale', 'price_tick', 'price_digits', 'price_padding',
+                 'qty_scale', 'qty_tick', 'qty_digits', 'qty_padding')
+
+    def __init__(self, instrument):
+        self.price_scale, self.price_tick, self.price_digits = _parse_tick(instrument['price_tick_size'])
+        self.qty_scale, self.qty_tick, self.qty_digits = _parse_tick(instrument['qty_tick_size'])
+        # Trailing zeros to reach the exchange's display precision when it exceeds the tick's
+        self.price_padding = '0' * max(int(instrument.get('quote_decimals', 0)) - self.price_digits, 0)
+        self.qty_padding = '0' * max(int(instrument.get('quantity_decimals', 0)) - self.qty_digits, 0)
+
+    def format_price(self, price, side):
+        # Buys round down and sells round up, so rounding never makes an order more aggressive
+        units = _to_units(price, self.price_scale, side == 'SELL')
+        ticks = -(-units // self.price_tick) if side == 'SELL' else units // self.price_tick
+        return _format_units(ticks * self.price_tick, self.price_scale, self.price_digits, self.price_padding)
+
+    def format_quantity(self, amount):
+        ticks = _to_units(amount, self.qty_scale, False) // self.qty_tick
+        return _format_units(ticks * self.qty_tick, self.qty_scale, self.qty_digits, self.qty_padding)
+
+
+def _parse_tick(tick_size):
+    # '0.0005' -> scale 10000, tick 5 units, 4 digits
+    whole, _, fraction = tick_size.strip().partition('.')
+    fraction = fraction.rstrip('0')
+    scale = 10 ** len(fraction)
+    return scale, int(whole or 0) * scale + int(fraction or 0), len(fraction)
+
+
+def _to_units(value, scale, round_up):
+    scaled = value * scale
+    nearest = round(scaled)
+    # A value on the grid that float arithmetic put a hair off it, e.g. 0.09 * 10000 = 899.9999999999999
+    if abs(scaled - nearest) < 1e-6:
+        return nearest
+    units = int(scaled)
+    return units + 1 if round_up and units < scaled else units
+
+
+def _format_units(units, scale, digits, padding):
+    if digits == 0:
+        return f"{units}{'.' + padding if padding else ''}"
+    whole, fraction = divmod(units, scale)
+    return f"{whole}.{fraction:0{digits}d}{padding}"
+
+
+class InstrumentCache:
+    """Instrument metadata from public/get-instruments, kept in a JSON file so a restart does not wait on REST.
+
+    A cached copy is used straight away, whatever its age, and refreshed in the background once older than ttl;
+    only a missing or unreadable cache makes load() fetch before returning.
+    """
+
+    def __init__(self, path, rest_endpoint_prefix, ttl_sec, logger, app_name):
+        self.path = path
+        self.instruments_url = rest_endpoint_prefix + "public/get-instruments"
+        self.ttl_sec = ttl_sec
+        self.logger = logger
+        self.app_name = app_name
+        self.instruments = None
+        self.fetched_at = 0
+        self.listeners = []
+
+    def add_listener(self, listener):
+        # Called with the instruments map every time it is replaced
+        self.listeners.append(listener)
+
+    async def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                cached = json.load(file)
+            self._update(cached['instruments'], cached['fetched_at'])
+            self.logger.info(f"{self.app_name} - Loaded {len(self.instruments)} instruments from {self.path}")
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.info(f"{self.app_name} - No usable instrument cache at {self.path} ({e}), fetching")
+            await self.refresh()
+
+    async def refresh(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(self.instruments_url) as response:
+                if response.status == 200:
+                    instruments_data = await response.json()
+                    if instruments_data.get("code") == 0:
+                        instruments = {
+                            instrument["symbol"]: instrument
+                            for instrument in instruments_data["result"]["data"]
+                        }
+                        self._update(instruments, time.time())
+                        self._save()
+                        self.logger.info(f"{self.app_name} - Instruments map updated.")
+                    else:
+                        self.logger.error(
+                            f"{self.app_name} - Failed to get instruments: {instruments_data.get('message')}")
+                else:
+                    self.logger.error(f"{self.app_name} - Failed to get instruments, HTTP status: {response.status}")
+
+    async def refresh_periodically(self, shutdown_event):
+        while not shutdown_event.is_set():
+            await asyncio.sleep(max(self.fetched_at + self.ttl_sec - time.time(), 0))
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.logger.error(f"{self.app_name} - Failed to refresh instruments: {e}")
+            if time.time() - self.fetched_at >= self.ttl_sec:
+                # The refresh failed, retry well before another full ttl
+                await asyncio.sleep(min(self.ttl_sec, 60))
+
+    def _update(self, instruments, fetched_at):
+        self.instruments = instruments
+        self.fetched_at = fetched_at
+        for listener in self.listeners:
+            listener(instruments)
+
+    def _save(self):
+        # Written aside and renamed, so a crash never leaves a truncated cache behind
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'fetched_at': self.fetched_at, 'instruments': self.instruments}, file)
+        os.replace(temp_path, self.path)
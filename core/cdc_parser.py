@@ -0,0 +1,94 @@
+import json
+from order_book import iso8601
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+ORDER_STATUSES = {
+    'NEW': 'open',
+    'PENDING': 'open',
+    'ACTIVE': 'open',
+    'FILLED': 'closed',
+    'CANCELED': 'canceled',
+    'REJECTED': 'rejected',
+    'EXPIRED': 'expired'
+}
+
+TIME_IN_FORCE = {
+    'GOOD_TILL_CANCEL': 'GTC',
+    'IMMEDIATE_OR_CANCEL': 'IOC',
+    'FILL_OR_KILL': 'FOK'
+}
+
+
+def parse_levels(levels):
+    # CDC levels are [price, quantity, number of orders] as strings; a zero quantity removes the level
+    return [[float(level[0]), float(level[1])] for level in levels]
+
+
+def parse_symbol(instrument_name):
+    # What ccxt reports without loaded markets: BTC_USD becomes BTC/USD, derivatives keep their name
+    base, separator, quote = instrument_name.partition('_')
+    return f"{base}/{quote}" if separator else instrument_name
+
+
+def parse_order_book(data, symbol):
+    """A CDC book snapshot as a ccxt order book; CDC already sends bids descending and asks ascending."""
+    timestamp = data.get('t')
+    return {
+        'symbol': symbol,
+        'bids': parse_levels(data['bids']),
+        'asks': parse_levels(data['asks']),
+        'timestamp': timestamp,
+        'datetime': iso8601(timestamp),
+        'nonce': data.get('u')
+    }
+
+
+def parse_order(order):
+    """A CDC user.order entry as a ccxt order."""
+    created = order.get('create_time')
+    price = _float(order.get('limit_price'))
+    amount = _float(order.get('quantity'))
+    filled = _float(order.get('cumulative_quantity'))
+    average = _float(order.get('avg_price')) or None
+    exec_inst = order.get('exec_inst')
+    fee = {'currency': order.get('fee_instrument_name'), 'cost': _float(order.get('cumulative_fee'))}
+    return {
+        'info': order,
+        'id': order.get('order_id'),
+        'clientOrderId': order.get('client_oid'),
+        'timestamp': created,
+        'datetime': iso8601(created),
+        'lastTradeTimestamp': order.get('update_time'),
+        'lastUpdateTimestamp': order.get('update_time'),
+        'symbol': parse_symbol(order['instrument_name']),
+        'type': (order.get('order_type') or '').lower() or None,
+        'timeInForce': TIME_IN_FORCE.get(order.get('time_in_force'), order.get('time_in_force')),
+        'postOnly': None if exec_inst is None else 'POST_ONLY' in exec_inst,
+        'reduceOnly': None,
+        'side': (order.get('side') or '').lower() or None,
+        'price': price,
+        'triggerPrice': None,
+        'amount': amount,
+        'cost': _float(order.get('cumulative_value')),
+        'average': average,
+        'filled': filled,
+        'remaining': amount - filled if amount is not None and filled is not None else None,
+        'status': ORDER_STATUSES.get(order.get('status'), order.get('status')),
+        'fee': fee,
+        'trades': [],
+        'fees': [fee]
+    }
+
+
+def parse_orders(orders):
+    return [parse_order(order) for order in orders]
+
+
+def _float(value):
+    return None if value is None or value == '' else float(value)
@@ -0,0 +1,95 @@
+import argparse
+import json
+import time
+from cdc_parser import loads, parse_order_book, parse_orders
+
+SAMPLE_BOOK = json.dumps({
+    "id": -1, "method": "subscribe", "code": 0,
+    "result": {
+        "instrument_name": "CRO_USD", "subscription": "book.CRO_USD.10", "channel": "book", "depth": 10,
+        "data": [{
+            "bids": [[f"{0.0950 - i * 0.0001:.4f}", f"{1000 + i * 37}", "2"] for i in range(10)],
+            "asks": [[f"{0.0951 + i * 0.0001:.4f}", f"{900 + i * 41}", "1"] for i in range(10)],
+            "t": 1700000000123, "tt": 1700000000120, "u": 123456789, "cs": 0
+        }]
+    }
+})
+
+SAMPLE_ORDERS = json.dumps({
+    "id": -1, "method": "subscribe", "code": 0,
+    "result": {
+        "instrument_name": "CRO_USD", "subscription": "user.order.CRO_USD", "channel": "user.order.CRO_USD",
+        "data": [{
+            "account_id": "52e7c00f-1324-5a6z-bfgt-de445bde21a5", "order_id": "19848525", "client_oid": "1613571154900",
+            "order_type": "LIMIT", "time_in_force": "GOOD_TILL_CANCEL", "side": "BUY", "exec_inst": ["POST_ONLY"],
+            "quantity": "1000", "limit_price": "0.0950", "order_value": "95", "avg_price": "0",
+            "cumulative_quantity": "0", "cumulative_value": "0", "cumulative_fee": "0", "status": "ACTIVE",
+            "order_date": "2021-02-17", "instrument_name": "CRO_USD", "fee_instrument_name": "CRO",
+            "create_time": 1613575617173, "create_time_ns": "1613575617173123456", "update_time": 1613575617173
+        }]
+    }
+})
+
+
+def native_parse(payload):
+    result = loads(payload)['result']
+    if result['channel'] == 'book':
+        return parse_order_book(result['data'][0], result['instrument_name'])
+    return parse_orders(result['data'])
+
+
+def ccxt_parser():
+    import ccxt
+    exchange = ccxt.cryptocom()
+
+    def ccxt_parse(payload):
+        result = json.loads(payload)['result']
+        if result['channel'] == 'book':
+            data0 = result['data'][0]
+            return exchange.parse_order_book(orderbook=data0, symbol=result['instrument_name'], timestamp=data0['t'])
+        return exchange.parse_orders(orders=result['data'])
+
+    return ccxt_parse
+
+
+def load_payloads(filename):
+    # Raw websocket messages, one per line, as received by the gateway; only book and user.order results are kept
+    payloads = []
+    with open(filename, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            result = json.loads(line).get('result', {})
+            if result.get('channel') == 'book' or result.get('channel', '').startswith('user.order'):
+                payloads.append(line)
+    return payloads
+
+
+def benchmark(name, parse, payloads, repeat):
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        for payload in payloads:
+            parse(payload)
+    elapsed = time.perf_counter_ns() - start
+    per_message_us = elapsed / (repeat * len(payloads)) / 1000
+    print(f"{name:>8}: {per_message_us:8.2f} us per message")
+    return per_message_us
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the native CDC parser against the ccxt parsing path")
+    parser.add_argument('--payloads', type=str, help='File of recorded raw websocket messages, one per line')
+    parser.add_argument('--repeat', type=int, help='Number of passes over the payloads', default=10000)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads) if args.payloads else [SAMPLE_BOOK, SAMPLE_ORDERS]
+    print(f"{len(payloads)} payloads, {args.repeat} passes")
+    native_us = benchmark('native', native_parse, payloads, args.repeat)
+    try:
+        ccxt_parse = ccxt_parser()
+    except ImportError:
+        print("ccxt is not installed, skipping the ccxt path")
+    else:
+        ccxt_us = benchmark('ccxt', ccxt_parse, payloads, args.repeat)
+        print(f"native parser is {ccxt_us / native_us:.1f}x faster")
@@ -1,7 +1,15 @@
 import gzip
 import json
 import os
-from datetime import datetime, timedelta
+import struct
+from datetime import datetime, timedelta, timezone
+
+# Seekable index entry per compressed block, also used by DailyGzipJsonWriter: min msg_time, max msg_time,
+# offset, length
+BLOCK_INDEX = struct.Struct('<qqQQ')
+# Files rotate forward only, so records stamped shortly before midnight but logged after it are in the next day's
+# file; it is read until msg_time passes the end of the range by this much
+LATE_RECORD_NS = 60_000_000_000
 
 
 class DailyGzipJsonReader:
@@ -25,16 +33,50 @@ class DailyGzipJsonReader:
             return None
 
     def read(self, start_ns, end_ns):
-        start_dt = datetime.fromtimestamp(start_ns / 1e9)
-        end_dt = datetime.fromtimestamp(end_ns / 1e9)
+        # Files are split on UTC dates, as msg_time is
+        start_date = datetime.fromtimestamp(start_ns / 1e9, tz=timezone.utc).date()
+        end_date = datetime.fromtimestamp(end_ns / 1e9, tz=timezone.utc).date()
 
-        for date in self._generate_file_dates(start_dt, end_dt):
+        for date in self._generate_file_dates(start_date, end_date):
             filename = self._get_filename(date)
             if filename:
-                open_func = gzip.open if filename.endswith('.gz') else open
-                with open_func(filename, 'rt', encoding='utf-8') as file:
-                    for line in file:
-                        data_dict = json.loads(line)
-                        msg_time_ns = data_dict.get("msg_time")
-                        if start_ns <= msg_time_ns <= end_ns:
-                            yield data_dict
+                yield from self._read_file(filename, start_ns, end_ns)
+        # Late records of the last day
+        filename = self._get_filename(end_date + timedelta(days=1))
+        if filename:
+            yield from self._read_file(filename, start_ns, end_ns, end_ns + LATE_RECORD_NS)
+
+    def _read_file(self, filename, start_ns, end_ns, stop_ns=None):
+        if os.path.exists(f"{filename}.idx"):
+            yield from self._read_blocks(filename, start_ns, end_ns, stop_ns)
+            return
+        open_func = gzip.open if filename.endswith('.gz') else open
+        with open_func(filename, 'rt', encoding='utf-8') as file:
+            for line in file:
+                data_dict = json.loads(line)
+                msg_time_ns = data_dict.get("msg_time")
+                # msg_time is not monotonic in sequence order, replies keep the msg_time of the message that
+                # triggered them, so the whole file is read, the next day's file up to stop_ns
+                if stop_ns is not None and msg_time_ns > stop_ns:
+                    return
+                if start_ns <= msg_time_ns <= end_ns:
+                    yield data_dict
+
+    def _read_blocks(self, filename, start_ns, end_ns, stop_ns=None):
+        with open(f"{filename}.idx", 'rb') as index_file:
+            index_data = index_file.read()
+        blocks = [BLOCK_INDEX.unpack_from(index_data, offset)
+                  for offset in range(0, len(index_data) - BLOCK_INDEX.size + 1, BLOCK_INDEX.size)]
+        with open(filename, 'rb') as file:
+            for min_time, max_time, offset, length in blocks:
+                if stop_ns is not None and min_time > stop_ns:
+                    return
+                # Only blocks whose msg_time range overlaps are decompressed; blocks are in sequence order, not
+                # msg_time order, so every index entry is checked
+                if max_time < start_ns or min_time > end_ns:
+                    continue
+                file.seek(offset)
+                for line in gzip.decompress(file.read(length)).splitlines():
+                    data_dict = json.loads(line)
+                    if start_ns <= data_dict.get("msg_time") <= end_ns:
+                        yield data_dict
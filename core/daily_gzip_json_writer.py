@@ -1,49 +1,183 @@
 import gzip
 import json
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+from daily_gzip_json_reader import BLOCK_INDEX
+from datetime import datetime, timezone
+
+_STOP = object()
 
 
 class DailyGzipJsonWriter:
-    def __init__(self, base_path, base_filename):
+    def __init__(self, base_path, base_filename, seekable=False, block_messages=1000, buffered=False,
+                 max_buffer_messages=100000, flush_messages=1000, flush_interval=1.0, durability='line'):
         self.base_path = base_path.rstrip('/')  # Ensure no trailing slash
         self.base_filename = base_filename
+        # Seekable files are written as independently gzipped blocks with a sidecar index of their msg_time range
+        self.seekable = seekable
+        self.block_messages = block_messages
+        self.block = []
+        self.block_times = None
+        self.block_started = None
+        self.index_file = None
+        # Durability: 'line' flushes every message, 'flush' flushes to the OS every flush_messages or
+        # flush_interval seconds, 'fsync' also syncs to disk then. A seekable block reaches the file once it is
+        # full, once it is flush_interval seconds old or on close, whatever the durability; an unbuffered writer
+        # needs flush() called periodically for a block to be cut while no messages arrive
+        self.durability = durability
+        self.flush_messages = flush_messages
+        self.flush_interval = flush_interval
+        self.unflushed = 0
         self.current_file_date = None
         self.file = None
         self.current_filename = None
+        self.gzip_threads = []
+        # Buffered writers only enqueue on write(); serialising, writing and rotating happen on a worker thread
+        self.buffer = None
+        self.worker = None
+        self.error = None
+        if buffered:
+            self.buffer = queue.Queue(maxsize=max_buffer_messages)
+            self.worker = threading.Thread(target=self._run, name=f"{base_filename}-writer", daemon=True)
+            self.worker.start()
 
     def _get_filename(self, dt):
         date_str = dt.strftime("%Y-%m-%d")
-        return f"{self.base_path}/{self.base_filename}_{date_str}.json"
+        filename = f"{self.base_path}/{self.base_filename}_{date_str}.json"
+        return f"{filename}.gz" if self.seekable else filename
 
     def _gzip_file(self, filename):
+        # Readers prefer the .gz file, so it only appears once complete
         with open(filename, 'rb') as f_in:
-            with gzip.open(f"{filename}.gz", 'wb') as f_out:
+            with gzip.open(f"{filename}.gz.tmp", 'wb') as f_out:
                 f_out.writelines(f_in)
+        os.replace(f"{filename}.gz.tmp", f"{filename}.gz")
         os.remove(filename)
 
     def _open_new_file(self, dt):
         if self.file is not None:
-            self.file.close()
-            self._gzip_file(self.current_filename)
+            self._close_file()
+            if not self.seekable:
+                # Compress the previous day in the background so writing the new day is not held up
+                gzip_thread = threading.Thread(target=self._gzip_file, args=(self.current_filename,),
+                                               name=f"{self.base_filename}-gzip")
+                gzip_thread.start()
+                self.gzip_threads = [thread for thread in self.gzip_threads if thread.is_alive()] + [gzip_thread]
         filename = self._get_filename(dt)
-        self.file = open(filename, 'a', encoding='utf-8')
+        if self.seekable:
+            self.file = open(filename, 'ab')
+            self.index_file = open(f"{filename}.idx", 'ab')
+        else:
+            self.file = open(filename, 'a', encoding='utf-8')
         self.current_file_date = dt.date()
         self.current_filename = filename
 
-    def write(self, data_dict):
+    def _write_block(self):
+        # Concatenated gzip members are still a valid gzip file for readers that ignore the index
+        offset = self.file.tell()
+        compressed = gzip.compress(''.join(self.block).encode('utf-8'))
+        self.file.write(compressed)
+        self.file.flush()
+        self.index_file.write(BLOCK_INDEX.pack(self.block_times[0], self.block_times[1], offset, len(compressed)))
+        self.index_file.flush()
+        self.block = []
+        self.block_times = None
+        self.block_started = None
+
+    def _write(self, data_dict):
         msg_time_ns = data_dict.get("msg_time")
         if msg_time_ns is None:
             raise ValueError("msg_time field is missing in data_dict")
 
-        msg_time = datetime.fromtimestamp(msg_time_ns / 1e9)
-        if self.current_file_date != msg_time.date():
+        msg_time = datetime.fromtimestamp(msg_time_ns / 1e9, tz=timezone.utc)
+        # Files only rotate forward: a late record stamped before midnight, such as a reply keeping the msg_time
+        # of the message that triggered it, goes into the current day's file, as the previous one may be gzipping
+        if self.current_file_date is None or msg_time.date() > self.current_file_date:
             self._open_new_file(msg_time)
 
         json_str = json.dumps(data_dict)
-        self.file.write(json_str + '\n')
-        self.file.flush()  # Flush data to file after each write
+        if self.seekable:
+            if not self.block:
+                self.block_started = time.monotonic()
+            self.block.append(json_str + '\n')
+            # msg_time is not monotonic, replies keep the msg_time of the message that triggered them
+            self.block_times = ((min(self.block_times[0], msg_time_ns), max(self.block_times[1], msg_time_ns))
+                                if self.block_times else (msg_time_ns, msg_time_ns))
+            # A buffered writer's worker cuts blocks on the interval itself
+            if len(self.block) >= self.block_messages or \
+                    (self.buffer is None and time.monotonic() - self.block_started >= self.flush_interval):
+                self._write_block()
+        else:
+            self.file.write(json_str + '\n')
+        self.unflushed += 1
+        if self.durability == 'line' or self.unflushed >= self.flush_messages:
+            # Only size, age and closing cut a seekable block, or every message would be its own block
+            self._flush(cut_block=False)
+
+    def _flush(self, cut_block=True):
+        if self.file is not None:
+            if self.block and cut_block:
+                self._write_block()
+            self.file.flush()
+            if self.durability == 'fsync':
+                os.fsync(self.file.fileno())
+                if self.index_file is not None:
+                    os.fsync(self.index_file.fileno())
+        self.unflushed = 0
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                data_dict = self.buffer.get(timeout=max(0.0, last_flush + self.flush_interval - time.monotonic()))
+            except queue.Empty:
+                data_dict = None
+            try:
+                if data_dict is _STOP:
+                    self._flush()
+                    return
+                if data_dict is not None:
+                    self._write(data_dict)
+                if (self.unflushed or self.block) and time.monotonic() - last_flush >= self.flush_interval:
+                    self._flush()
+                if self.unflushed == 0 and not self.block:
+                    last_flush = time.monotonic()
+            except Exception as e:
+                # Raised to the caller on its next write
+                self.error = e
+
+    def flush(self):
+        # For an unbuffered writer, called every flush_interval so an open block or unflushed lines reach the file
+        # while no messages arrive; a buffered writer's worker does this itself
+        if self.buffer is None and (self.unflushed or self.block):
+            self._flush(cut_block=bool(self.block) and
+                        time.monotonic() - self.block_started >= self.flush_interval)
+
+    def write(self, data_dict):
+        if self.buffer is None:
+            self._write(data_dict)
+            return
+        if self.error is not None:
+            raise self.error
+        # Blocks once max_buffer_messages are waiting, pushing back rather than growing without bound
+        self.buffer.put(data_dict)
+
+    def _close_file(self):
+        self._flush()
+        self.file.close()
+        self.file = None
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
 
     def close(self):
+        if self.worker is not None:
+            self.buffer.put(_STOP)
+            self.worker.join()
+            self.worker = None
         if self.file is not None:
-            self.file.close()
+            self._close_file()
+        for gzip_thread in self.gzip_threads:
+            gzip_thread.join()
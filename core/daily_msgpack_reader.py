@@ -0,0 +1,100 @@
+import mmap
+import msgpack
+import os
+import struct
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+
+# Record, also used by DailyMsgpackWriter: msg_time, header frame length, payload frame length, then the frames
+# exactly as received
+RECORD = struct.Struct('<qII')
+# Files rotate forward only, so records stamped shortly before midnight but logged after it are in the next day's
+# file; it is read until msg_time passes the end of the range by this much
+LATE_RECORD_NS = 60_000_000_000
+
+
+class LazyMessage(Mapping):
+    """Read-only message dict whose msgpack payload is only decoded when a field is first read.
+
+    msg_type, exchange, symbol, seq and msg_time come from the small header frame without decoding the payload.
+    """
+    __slots__ = ('msg_type', 'exchange', 'symbol', 'seq', 'msg_time', 'payload', '_message')
+
+    def __init__(self, msg_time, header, payload):
+        if header:
+            self.msg_type, self.exchange, self.symbol, self.seq, _ = msgpack.unpackb(header, raw=False)
+            self._message = None
+        else:
+            self._message = msgpack.unpackb(payload, raw=False)
+            self.msg_type = self._message.get('msg_type')
+            self.exchange = self._message.get('exchange')
+            self.symbol = self._message.get('symbol')
+            self.seq = self._message.get('seq')
+        self.msg_time = msg_time
+        self.payload = payload
+
+    def _decode(self):
+        if self._message is None:
+            message = msgpack.unpackb(self.payload, raw=False)
+            if self.seq is not None:
+                message['seq'] = self.seq
+            message['msg_time'] = self.msg_time
+            self._message = message
+        return self._message
+
+    def __getitem__(self, key):
+        if key == 'msg_time':
+            return self.msg_time
+        return self._decode()[key]
+
+    def __iter__(self):
+        return iter(self._decode())
+
+    def __len__(self):
+        return len(self._decode())
+
+
+class DailyMsgpackReader:
+    def __init__(self, base_path, base_filename):
+        self.base_path = base_path.rstrip('/')  # Ensure no trailing slash
+        self.base_filename = base_filename
+
+    def _generate_file_dates(self, start_date, end_date):
+        delta = end_date - start_date
+        return [start_date + timedelta(days=i) for i in range(delta.days + 1)]
+
+    def _get_filename(self, date):
+        date_str = date.strftime("%Y-%m-%d")
+        filename = f"{self.base_path}/{self.base_filename}_{date_str}.msgpack"
+        return filename if os.path.exists(filename) and os.path.getsize(filename) > 0 else None
+
+    def read(self, start_ns, end_ns, raw=False):
+        """Yield LazyMessage objects, or (msg_time, header, payload) tuples of raw frames when raw is set."""
+        start_date = datetime.fromtimestamp(start_ns / 1e9, tz=timezone.utc).date()
+        end_date = datetime.fromtimestamp(end_ns / 1e9, tz=timezone.utc).date()
+
+        for date in self._generate_file_dates(start_date, end_date):
+            yield from self._read_file(date, start_ns, end_ns, raw)
+        # Late records of the last day
+        yield from self._read_file(end_date + timedelta(days=1), start_ns, end_ns, raw, end_ns + LATE_RECORD_NS)
+
+    def _read_file(self, date, start_ns, end_ns, raw, stop_ns=None):
+        filename = self._get_filename(date)
+        if filename:
+            with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while offset + RECORD.size <= len(data):
+                    msg_time_ns, header_len, payload_len = RECORD.unpack_from(data, offset)
+                    header_start = offset + RECORD.size
+                    payload_start = header_start + header_len
+                    offset = payload_start + payload_len
+                    if offset > len(data):
+                        break
+                    # msg_time is not monotonic in sequence order, replies keep the msg_time of the message that
+                    # triggered them, so the whole file is read, the next day's file up to stop_ns
+                    if stop_ns is not None and msg_time_ns > stop_ns:
+                        break
+                    if start_ns <= msg_time_ns <= end_ns:
+                        header = data[header_start:payload_start]
+                        payload = data[payload_start:offset]
+                        yield (msg_time_ns, header, payload) if raw else LazyMessage(msg_time_ns, header, payload)
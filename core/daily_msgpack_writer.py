@@ -0,0 +1,55 @@
+import os
+from daily_msgpack_reader import RECORD
+from datetime import datetime, timezone
+
+
+class DailyMsgpackWriter:
+    def __init__(self, base_path, base_filename, flush_messages=1000, durability='flush'):
+        self.base_path = base_path.rstrip('/')  # Ensure no trailing slash
+        self.base_filename = base_filename
+        # Durability: 'line' flushes every message, 'flush' every flush_messages or on flush(), 'fsync' also syncs
+        self.flush_messages = flush_messages
+        self.durability = durability
+        self.unflushed = 0
+        self.current_file_date = None
+        self.file = None
+
+    def _get_filename(self, dt):
+        date_str = dt.strftime("%Y-%m-%d")
+        return f"{self.base_path}/{self.base_filename}_{date_str}.msgpack"
+
+    def _open_new_file(self, dt):
+        self.close()
+        self.file = open(self._get_filename(dt), 'ab', buffering=1 << 20)
+        self.current_file_date = dt.date()
+
+    def write(self, msg_time_ns, frames):
+        if msg_time_ns is None:
+            raise ValueError("msg_time is missing")
+
+        msg_time = datetime.fromtimestamp(msg_time_ns / 1e9, tz=timezone.utc)
+        # Files only rotate forward, a late record stamped before midnight goes into the current day's file
+        if self.current_file_date is None or msg_time.date() > self.current_file_date:
+            self._open_new_file(msg_time)
+
+        # A single frame is a whole message from an app that predates the envelope, logged without a header
+        header, payload = frames[-2:] if len(frames) > 1 else (b'', frames[0])
+        self.file.write(RECORD.pack(msg_time_ns, len(header), len(payload)))
+        self.file.write(header)
+        self.file.write(payload)
+        self.unflushed += 1
+        if self.durability == 'line' or self.unflushed >= self.flush_messages:
+            self.flush()
+
+    def flush(self):
+        if self.file is not None and self.unflushed:
+            self.file.flush()
+            if self.durability == 'fsync':
+                os.fsync(self.file.fileno())
+        self.unflushed = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
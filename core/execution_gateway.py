@@ -1,14 +1,27 @@
 import argparse
 import os
 import asyncio
+from collections import deque
 import ccxt.pro as ccxtpro
 from proxy_app import ProxyApp
 from base_app import MessageType
+from rate_limiter import CANCEL, NEW, RateLimiter
 from ccxt.base.types import Order, Trade
 from typing import List
 from dotenv import load_dotenv
 
 
+class OrderLane:
+    """A symbol's instructions, executed one at a time in arrival order except that cancels go first."""
+    __slots__ = ('symbol', 'cancels', 'creates', 'busy')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.cancels = deque()
+        self.creates = deque()
+        self.busy = False
+
+
 class ExecutionGateway(ProxyApp):
     def __init__(self, config_file):
         super().__init__(config_file)
@@ -20,6 +33,15 @@ class ExecutionGateway(ProxyApp):
         load_dotenv()
         self.exchange_params['apiKey'] = os.environ.get(self.config['Exchange']['api_key_env'])
         self.exchange_params['secret'] = os.environ.get(self.config['Exchange']['secret_env'])
+        # Requests in flight across all symbols; each symbol has at most one so its instructions stay in order
+        self.max_in_flight = int(self.config['Exchange'].get('max_in_flight', 10))
+        self.lanes = {}
+        self.in_flight = 0
+        self.executing = set()
+        # Local request budget per ccxt method, in front of the exchange's own limits; no section means no limit
+        self.rate_limiter = (RateLimiter.from_config(self.config['RateLimit'])
+                             if self.config.has_section('RateLimit') else RateLimiter({}))
+        self.stats_interval = int(self.config['Exchange'].get('stats_interval_sec', 60))
 
     async def post_start(self):
         await super().post_start()
@@ -28,9 +50,12 @@ class ExecutionGateway(ProxyApp):
         task1 = asyncio.create_task(self.handle_message())
         task2 = asyncio.create_task(self.send_order_updates())
         task3 = asyncio.create_task(self.send_trade_executions())
-        self.tasks.update({task1, task2, task3})
+        task4 = asyncio.create_task(self.report_statistics())
+        self.tasks.update({task1, task2, task3, task4})
 
     async def pre_stop(self):
+        for task in list(self.executing):
+            task.cancel()
         await self.exchange.close()
         await super().pre_stop()
 
@@ -38,25 +63,108 @@ class ExecutionGateway(ProxyApp):
         while not self.shutdown_event.is_set():
             message = await self.receive()
             if message.get('exchange') == self.exchange_id:
-                if message['msg_type'] == MessageType.CREATE_ORDER.value:
-                    try:
-                        self.logger.info(f"{self.app_name} - received create order for {message['symbol']}")
-                        await self.exchange.create_order(**message['data'])
-                    except Exception as e:
-                        self.logger.error(f"{self.app_name} - create order reject for {message['symbol']}")
-                        reject_message = {
-                            'msg_type': MessageType.CREATE_ORDER_REJECT.value,
-                            'exchange': self.exchange_id,
-                            'symbol': message['symbol'],
-                            'data': message['data']
-                        }
-                        await self.send(reject_message)
-                elif message['msg_type'] == MessageType.CANCEL_ORDER.value:
-                    self.logger.info(f"{self.app_name} - received cancel order instruction for {message['data']['id']}")
+                await self.submit(message)
+                self.dispatch()
+
+    async def submit(self, message):
+        msg_type = message['msg_type']
+        if msg_type not in (MessageType.CREATE_ORDER.value, MessageType.CANCEL_ORDER.value,
+                            MessageType.CANCEL_ALL_ORDER.value):
+            return
+        lane = self.lanes.get(message['symbol'])
+        if lane is None:
+            lane = self.lanes[message['symbol']] = OrderLane(message['symbol'])
+        if msg_type == MessageType.CREATE_ORDER.value:
+            self.logger.info(f"{self.app_name} - received create order for {message['symbol']}")
+            lane.creates.append(message)
+        elif msg_type == MessageType.CANCEL_ORDER.value:
+            self.logger.info(f"{self.app_name} - received cancel order instruction for {message['data']['id']}")
+            client_order_id = message['data'].get('params', {}).get('clientOrderId')
+            for create in lane.creates:
+                if client_order_id is not None and create['data']['params'].get('clientOrderId') == client_order_id:
+                    # The order never reached the exchange, so neither goes out
+                    lane.creates.remove(create)
+                    self.logger.info(f"{self.app_name} - dropped queued create order {client_order_id} on cancel")
+                    await self.reject(MessageType.CREATE_ORDER_REJECT, create)
+                    return
+            lane.cancels.append(message)
+        else:
+            self.logger.info(f"{self.app_name} - received cancel all orders instruction")
+            for create in lane.creates:
+                await self.reject(MessageType.CREATE_ORDER_REJECT, create)
+            lane.creates.clear()
+            lane.cancels.append(message)
+
+    def dispatch(self):
+        while self.in_flight < self.max_in_flight:
+            lane = self.next_lane()
+            if lane is None:
+                return
+            message = lane.cancels.popleft() if lane.cancels else lane.creates.popleft()
+            lane.busy = True
+            self.in_flight += 1
+            task = asyncio.create_task(self.execute(lane, message))
+            self.executing.add(task)
+            task.add_done_callback(self.executing.discard)
+
+    def next_lane(self):
+        # Idle lanes with a cancel waiting come first, then idle lanes with a create in arrival order
+        idle_lanes = [lane for lane in self.lanes.values() if not lane.busy]
+        for lane in idle_lanes:
+            if lane.cancels:
+                return lane
+        for lane in idle_lanes:
+            if lane.creates:
+                return lane
+        return None
+
+    async def execute(self, lane, message):
+        try:
+            if message['msg_type'] == MessageType.CREATE_ORDER.value:
+                if not await self.rate_limiter.acquire('create_order', NEW, message.get('msg_time')):
+                    self.logger.warning(f"{self.app_name} - create order for {message['symbol']} shed, "
+                                        f"over the request budget")
+                    await self.reject(MessageType.CREATE_ORDER_REJECT, message)
+                    return
+                try:
+                    await self.exchange.create_order(**message['data'])
+                except Exception as e:
+                    self.logger.error(f"{self.app_name} - create order reject for {message['symbol']}: {e}")
+                    await self.reject(MessageType.CREATE_ORDER_REJECT, message)
+            elif message['msg_type'] == MessageType.CANCEL_ORDER.value:
+                await self.rate_limiter.acquire('cancel_order', CANCEL)
+                try:
                     await self.exchange.cancel_order(**message['data'])
-                elif message['msg_type'] == MessageType.CANCEL_ALL_ORDER.value:
-                    self.logger.info(f"{self.app_name} - received cancel all orders instruction")
+                except Exception as e:
+                    self.logger.error(f"{self.app_name} - cancel order reject for {message['data']['id']}: {e}")
+                    await self.reject(MessageType.CANCEL_ORDER_REJECT, message)
+            else:
+                await self.rate_limiter.acquire('cancel_all_orders', CANCEL)
+                try:
                     await self.exchange.cancel_all_orders(**message['data'])
+                except Exception as e:
+                    self.logger.error(f"{self.app_name} - cancel all orders reject for {message['symbol']}: {e}")
+                    await self.reject(MessageType.CANCEL_ORDER_REJECT, message)
+        finally:
+            lane.busy = False
+            self.in_flight -= 1
+            if not self.shutdown_event.is_set():
+                self.dispatch()
+
+    async def reject(self, msg_type, message):
+        reject_message = {
+            'msg_type': msg_type.value,
+            'exchange': self.exchange_id,
+            'symbol': message['symbol'],
+            'data': message['data']
+        }
+        await self.send(reject_message)
+
+    async def report_statistics(self):
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(self.stats_interval)
+            for endpoint, statistics in self.rate_limiter.utilisation().items():
+                self.logger.info(f"{self.app_name} - Rate limit for {endpoint}: {statistics}")
 
     async def send_order_updates(self):
         while not self.shutdown_event.is_set():
@@ -0,0 +1,163 @@
+import glob
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+
+# Record: header length, payload length, seq, msg_time, then the header and payload frames as sequenced
+RECORD = struct.Struct('<IIQq')
+# Index entry for every record: seq, msg_time, offset of the record in the journal file
+INDEX_ENTRY = struct.Struct('<Qqq')
+
+
+class JournalWriter:
+    """Append-only daily journal of sequenced messages with a fixed-width index for seeking by seq or msg_time."""
+
+    def __init__(self, base_path, base_filename):
+        self.base_path = base_path.rstrip('/')  # Ensure no trailing slash
+        self.base_filename = base_filename
+        self.current_file_date = None
+        self.file = None
+        self.index_file = None
+
+    def _open_new_file(self, date):
+        self.close()
+        filename = _journal_filename(self.base_path, self.base_filename, date)
+        self.file = open(filename, 'ab')
+        self.index_file = open(f"{filename}.idx", 'ab')
+        self.current_file_date = date
+
+    def last_seq(self):
+        # The sequence continues from the newest journal on disk across restarts
+        return _last_seq(self.base_path, self.base_filename)
+
+    def write(self, seq, msg_time, header, payload):
+        date = datetime.fromtimestamp(msg_time / 1e9, tz=timezone.utc).date()
+        # msg_time is not monotonic in sequence order, replies keep the msg_time of the message that triggered them;
+        # rotating forward only keeps every file a contiguous seq range that follows the previous file's
+        if self.current_file_date is None or date > self.current_file_date:
+            self._open_new_file(date)
+        offset = self.file.tell()
+        self.file.write(RECORD.pack(len(header), len(payload), seq, msg_time))
+        self.file.write(header)
+        self.file.write(payload)
+        self.index_file.write(INDEX_ENTRY.pack(seq, msg_time, offset))
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+            self.index_file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.index_file.close()
+            self.file = None
+            self.index_file = None
+
+
+class JournalReader:
+    """Replays journal records from a seq or msg_time through memory-mapped journal and index files."""
+
+    def __init__(self, base_path, base_filename):
+        self.base_path = base_path.rstrip('/')  # Ensure no trailing slash
+        self.base_filename = base_filename
+
+    def day_start_seq(self, date):
+        """The first seq journaled on a UTC date, or the next seq to be journaled when there is none yet."""
+        filename = _journal_filename(self.base_path, self.base_filename, date)
+        with _map(f"{filename}.idx") as index:
+            if index is not None and len(index) >= INDEX_ENTRY.size:
+                return INDEX_ENTRY.unpack_from(index, 0)[0]
+        return _last_seq(self.base_path, self.base_filename) + 1
+
+    def read(self, from_seq=None, from_time=None, to_seq=None):
+        """Yield (seq, msg_time, header, payload) in seq order up to to_seq, starting at from_seq or at the first
+        record with msg_time at or after from_time."""
+        started = from_seq is None and from_time is None
+        for filename in _journal_files(self.base_path, self.base_filename):
+            with _map(filename) as journal, _map(f"{filename}.idx") as index:
+                if journal is None or index is None:
+                    continue
+                count = len(index) // INDEX_ENTRY.size
+                if started:
+                    position = 0
+                elif from_seq is not None:
+                    position = _bisect_index(index, count, from_seq)
+                else:
+                    # msg_time is not sorted within a file, so it is scanned for rather than bisected
+                    position = _scan_index(index, count, from_time)
+                if position >= count:
+                    continue
+                started = True
+                offset = INDEX_ENTRY.unpack_from(index, position * INDEX_ENTRY.size)[2]
+                while offset + RECORD.size <= len(journal):
+                    header_len, payload_len, seq, msg_time = RECORD.unpack_from(journal, offset)
+                    header_start = offset + RECORD.size
+                    payload_start = header_start + header_len
+                    offset = payload_start + payload_len
+                    if offset > len(journal):
+                        # A record still being written
+                        return
+                    if to_seq is not None and seq > to_seq:
+                        return
+                    yield seq, msg_time, journal[header_start:payload_start], journal[payload_start:offset]
+
+
+def _journal_filename(base_path, base_filename, date):
+    return f"{base_path}/{base_filename}_{date.strftime('%Y-%m-%d')}.journal"
+
+
+def _last_seq(base_path, base_filename):
+    for filename in reversed(_journal_files(base_path, base_filename)):
+        index_size = os.path.getsize(f"{filename}.idx") if os.path.exists(f"{filename}.idx") else 0
+        if index_size >= INDEX_ENTRY.size:
+            with open(f"{filename}.idx", 'rb') as index_file:
+                index_file.seek((index_size // INDEX_ENTRY.size - 1) * INDEX_ENTRY.size)
+                return INDEX_ENTRY.unpack(index_file.read(INDEX_ENTRY.size))[0]
+    return 0
+
+
+def _journal_files(base_path, base_filename):
+    # Date-stamped names sort chronologically
+    return sorted(glob.glob(f"{glob.escape(base_path)}/{glob.escape(base_filename)}_*.journal"))
+
+
+class _map:
+    """Read-only mmap of a file as a context manager, None when the file is missing or empty."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.mapped = None
+
+    def __enter__(self):
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+            self.file = open(self.filename, 'rb')
+            self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mapped
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.file.close()
+
+
+def _bisect_index(index, count, seq):
+    # First index entry whose seq is at least seq
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if INDEX_ENTRY.unpack_from(index, middle * INDEX_ENTRY.size)[0] < seq:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _scan_index(index, count, msg_time):
+    # First index entry whose msg_time is at least msg_time
+    for position in range(count):
+        if INDEX_ENTRY.unpack_from(index, position * INDEX_ENTRY.size)[1] >= msg_time:
+            return position
+    return count
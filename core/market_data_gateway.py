@@ -1,6 +1,7 @@
 import argparse
 import asyncio
 import ccxt.pro as ccxtpro
+import time
 from base_app import BaseApp, MessageType
 
 
@@ -14,32 +15,134 @@ class MarketDataGateway(BaseApp):
         self.exchange_params = {
             k[6:]: v for k, v in self.config['Exchange'].items() if k.startswith('param_')
         }
+        # 'per_symbol' watches each symbol in its own task, 'multi' uses one multi-symbol watch, 'auto' picks
+        # 'multi' when the exchange supports it
+        self.watch_mode = self.config['Exchange'].get('watch_mode', 'auto')
+        self.stats_interval = int(self.config['Exchange'].get('stats_interval_sec', 60))
+        self.stale_after = float(self.config['Exchange'].get('stale_after_sec', 10))
+        # Local time of each symbol's last book and number of books since the last report
+        self.last_update = dict.fromkeys(self.symbols)
+        self.update_counts = dict.fromkeys(self.symbols, 0)
+        # 'always' publishes every book, 'top_of_book' and 'top_k' only when the best or the top_k levels change,
+        # 'interval' at most once per publish_interval_ms per symbol, always ending on the latest book
+        self.publish_policy = self.config['Exchange'].get('publish_policy', 'always')
+        self.publish_depth = int(self.config['Exchange'].get('publish_depth', self.limit))
+        self.top_k = int(self.config['Exchange'].get('top_k', 5))
+        self.publish_interval = float(self.config['Exchange'].get('publish_interval_ms', 100)) / 1000
+        self.published_levels = dict.fromkeys(self.symbols)
+        self.publish_times = dict.fromkeys(self.symbols, 0)
+        # Latest book held back by the interval policy, published when the interval is up
+        self.held_books = {}
+        self.held_book_tasks = {}
+        self.publish_counts = dict.fromkeys(self.symbols, 0)
 
     async def post_start(self):
         exchange_class = getattr(ccxtpro, self.exchange_id)
         self.exchange: ccxtpro.Exchange = exchange_class(self.exchange_params)
-        task1 = asyncio.create_task(self.send_order_book())
-        self.tasks.update({task1})
+        if self.watch_mode == 'multi' or (self.watch_mode == 'auto' and len(self.symbols) > 1 and
+                                          self.exchange.has.get('watchOrderBookForSymbols')):
+            self.logger.info(f"{self.app_name} - Watching {self.symbols} with one multi-symbol watch")
+            self.tasks.add(asyncio.create_task(self.watch_order_books()))
+        else:
+            # A quiet symbol only holds up its own task
+            for symbol in self.symbols:
+                self.tasks.add(asyncio.create_task(self.watch_order_book(symbol)))
+        self.tasks.add(asyncio.create_task(self.report_staleness()))
 
     async def pre_stop(self):
+        for task in self.held_book_tasks.values():
+            task.cancel()
         await self.exchange.close()
 
-    async def send_order_book(self):
+    async def watch_order_book(self, symbol):
         while not self.shutdown_event.is_set():
-            for symbol in self.symbols:
-                try:
-                    order_book = await self.exchange.watch_order_book(symbol, self.limit)
-                except Exception as e:
-                    self.logger.error(f"{self.app_name} - Error watching order book for {symbol}: {e}")
-                    continue
-                self.logger.debug(f"{self.app_name} - Sending order book for {symbol}: {order_book}")
-                message = {
-                    'msg_type': MessageType.ORDER_BOOK.value,
-                    'exchange': self.exchange_id,
-                    'symbol': symbol,
-                    'data': order_book
-                }
-                await self.send(message)
+            try:
+                order_book = await self.exchange.watch_order_book(symbol, self.limit)
+            except Exception as e:
+                self.logger.error(f"{self.app_name} - Error watching order book for {symbol}: {e}")
+                await asyncio.sleep(1)
+                continue
+            await self.send_order_book(symbol, order_book)
+
+    async def watch_order_books(self):
+        while not self.shutdown_event.is_set():
+            try:
+                # Returns whichever book changed first
+                order_book = await self.exchange.watch_order_book_for_symbols(self.symbols, self.limit)
+            except Exception as e:
+                self.logger.error(f"{self.app_name} - Error watching order books for {self.symbols}: {e}")
+                await asyncio.sleep(1)
+                continue
+            await self.send_order_book(order_book['symbol'], order_book)
+
+    async def send_order_book(self, symbol, order_book):
+        now = time.monotonic()
+        self.last_update[symbol] = now
+        self.update_counts[symbol] += 1
+        if self.publish_policy in ('top_of_book', 'top_k'):
+            depth = 1 if self.publish_policy == 'top_of_book' else self.top_k
+            levels = (_top_levels(order_book['bids'], depth), _top_levels(order_book['asks'], depth))
+            if levels == self.published_levels[symbol]:
+                return
+            self.published_levels[symbol] = levels
+        elif self.publish_policy == 'interval':
+            wait = self.publish_times[symbol] + self.publish_interval - now
+            if wait > 0:
+                if symbol not in self.held_books:
+                    self.held_book_tasks[symbol] = asyncio.create_task(self.publish_held_book(symbol, wait))
+                self.held_books[symbol] = self.trim_order_book(symbol, order_book)
+                return
+            self.publish_times[symbol] = now
+        await self.publish_order_book(symbol, self.trim_order_book(symbol, order_book))
+
+    async def publish_held_book(self, symbol, wait):
+        await asyncio.sleep(wait)
+        self.publish_times[symbol] = time.monotonic()
+        await self.publish_order_book(symbol, self.held_books.pop(symbol))
+
+    def trim_order_book(self, symbol, order_book):
+        # Only the configured depth and the unified fields, never the raw exchange payload
+        return {
+            'symbol': symbol,
+            'bids': _top_levels(order_book['bids'], self.publish_depth),
+            'asks': _top_levels(order_book['asks'], self.publish_depth),
+            'timestamp': order_book.get('timestamp'),
+            'datetime': order_book.get('datetime'),
+            'nonce': order_book.get('nonce')
+        }
+
+    async def publish_order_book(self, symbol, order_book):
+        self.publish_counts[symbol] += 1
+        self.logger.debug(f"{self.app_name} - Sending order book for {symbol}: {order_book}")
+        message = {
+            'msg_type': MessageType.ORDER_BOOK.value,
+            'exchange': self.exchange_id,
+            'symbol': symbol,
+            'data': order_book
+        }
+        await self.send(message)
+
+    async def report_staleness(self):
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(self.stats_interval)
+            self.log_staleness()
+
+    def log_staleness(self):
+        now = time.monotonic()
+        for symbol in self.symbols:
+            last_update = self.last_update[symbol]
+            staleness = None if last_update is None else round(now - last_update, 3)
+            log = self.logger.warning if staleness is None or staleness > self.stale_after else self.logger.info
+            log(f"{self.app_name} - {symbol}: {self.update_counts[symbol]} books, "
+                f"{self.publish_counts[symbol]} published, "
+                f"last {'never' if staleness is None else f'{staleness}s ago'}")
+            self.update_counts[symbol] = 0
+            self.publish_counts[symbol] = 0
+
+
+def _top_levels(levels, depth):
+    # ccxt levels may carry an order count or id after price and amount
+    return [[level[0], level[1]] for level in levels[:depth]]
 
 
 if __name__ == "__main__":
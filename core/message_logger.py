@@ -1,6 +1,8 @@
 import argparse
 import asyncio
+from base_app import Envelope
 from daily_gzip_json_writer import DailyGzipJsonWriter
+from daily_msgpack_writer import DailyMsgpackWriter
 from proxy_app import ProxyApp
 
 
@@ -9,6 +11,8 @@ class MessageLogger(ProxyApp):
     def __init__(self, config_file):
         super().__init__(config_file)
         self.writer = None
+        # 'json' decodes every message into gzipped JSON lines, 'msgpack' stores the frames as received
+        self.log_format = self.config.get('Logging', 'format', fallback='json')
 
     def _should_publish(self):
         return False
@@ -17,9 +21,30 @@ class MessageLogger(ProxyApp):
         await super().post_start()
         log_path = self.config['Logging']['path']
         log_filename = self.config['Logging']['filename']
-        self.writer = DailyGzipJsonWriter(log_path, log_filename)
+        if self.log_format == 'msgpack':
+            self.writer = DailyMsgpackWriter(
+                log_path, log_filename,
+                flush_messages=self.config.getint('Logging', 'flush_messages', fallback=1000),
+                durability=self.config.get('Logging', 'durability', fallback='flush'))
+            task1 = asyncio.create_task(self.receive_and_log_frames())
+            task2 = asyncio.create_task(self.flush_periodically())
+            self.tasks.update({task1, task2})
+            return
+        seekable = self.config.getboolean('Logging', 'seekable', fallback=False)
+        block_messages = self.config.getint('Logging', 'block_messages', fallback=1000)
+        buffered = self.config.getboolean('Logging', 'buffered', fallback=False)
+        self.writer = DailyGzipJsonWriter(
+            log_path, log_filename, seekable, block_messages,
+            buffered=buffered,
+            max_buffer_messages=self.config.getint('Logging', 'max_buffer_messages', fallback=100000),
+            flush_messages=self.config.getint('Logging', 'flush_messages', fallback=1000),
+            flush_interval=self.config.getfloat('Logging', 'flush_interval_sec', fallback=1.0),
+            durability=self.config.get('Logging', 'durability', fallback='line'))
         task1 = asyncio.create_task(self.receive_and_log())
         self.tasks.update({task1})
+        if not buffered:
+            # A buffered writer flushes and cuts blocks on its own thread
+            self.tasks.add(asyncio.create_task(self.flush_periodically()))
 
     async def pre_stop(self):
         self.writer.close()
@@ -34,6 +59,23 @@ class MessageLogger(ProxyApp):
         except Exception as e:
             self.logger.error(f"Error writing message: {e}")
 
+    async def receive_and_log_frames(self):
+        try:
+            while not self.shutdown_event.is_set():
+                frames = await self.receive_frames()
+                # Only the small header is decoded, for msg_time
+                envelope = Envelope.from_frames(frames)
+                self.logger.debug(f"Received message with type: {envelope.msg_type}")
+                self.writer.write(envelope.msg_time, frames)
+        except Exception as e:
+            self.logger.error(f"Error writing message: {e}")
+
+    async def flush_periodically(self):
+        flush_interval = self.config.getfloat('Logging', 'flush_interval_sec', fallback=1.0)
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(flush_interval)
+            self.writer.flush()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the MessageLogger app with the specified configuration")
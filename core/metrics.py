@@ -0,0 +1,47 @@
+class LatencyHistogram:
+    """Latency histogram with power-of-two microsecond buckets, cheap enough to record on the hot path."""
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, latency_ns):
+        # Bucket i holds latencies below 2**i microseconds
+        bucket = min((latency_ns // 1000).bit_length(), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += latency_ns
+        if latency_ns > self.max:
+            self.max = latency_ns
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the percentile, in microseconds
+        threshold = fraction * self.count
+        cumulative = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return 1 << bucket
+        return 1 << (self.BUCKETS - 1)
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_us': round(self.total / self.count / 1000, 1),
+            'p50_us': self.percentile(0.5),
+            'p99_us': self.percentile(0.99),
+            'max_us': round(self.max / 1000, 1)
+        }
+
+    def reset(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
@@ -0,0 +1,116 @@
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+
+class BookSide:
+    """One side of a book as parallel sorted arrays; bids are keyed on the negated price so both sides ascend."""
+    __slots__ = ('descending', 'keys', 'prices', 'sizes')
+
+    def __init__(self, descending):
+        self.descending = descending
+        self.keys = []
+        self.prices = []
+        self.sizes = []
+
+    def __len__(self):
+        return len(self.prices)
+
+    def clear(self):
+        self.keys.clear()
+        self.prices.clear()
+        self.sizes.clear()
+
+    def set_level(self, price, size):
+        """Set or, with a zero size, remove the level at price; returns whether the side changed."""
+        key = -price if self.descending else price
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            if size == 0:
+                del self.keys[index]
+                del self.prices[index]
+                del self.sizes[index]
+                return True
+            if self.sizes[index] != size:
+                self.sizes[index] = size
+                return True
+            return False
+        if size == 0:
+            return False
+        self.keys.insert(index, key)
+        self.prices.insert(index, price)
+        self.sizes.insert(index, size)
+        return True
+
+    def truncate(self, depth):
+        if len(self.prices) > depth:
+            del self.keys[depth:]
+            del self.prices[depth:]
+            del self.sizes[depth:]
+
+    def best(self):
+        return (self.prices[0], self.sizes[0]) if self.prices else None
+
+    def levels(self, depth=None):
+        return [[price, size] for price, size in zip(self.prices[:depth], self.sizes[:depth])]
+
+
+class OrderBook:
+    """Order book for one instrument maintained from a snapshot plus sequenced deltas.
+
+    Every delta names the sequence number of the update before it; when that does not match the last one applied
+    the book is marked out of sync and must be rebuilt from a fresh snapshot.
+    """
+    __slots__ = ('symbol', 'depth', 'bids', 'asks', 'timestamp', 'seq', 'synced')
+
+    def __init__(self, symbol, depth):
+        self.symbol = symbol
+        self.depth = depth
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.timestamp = None
+        self.seq = None
+        self.synced = False
+
+    def apply_snapshot(self, bids, asks, seq, timestamp):
+        self.bids.clear()
+        self.asks.clear()
+        for price, size in bids:
+            self.bids.set_level(price, size)
+        for price, size in asks:
+            self.asks.set_level(price, size)
+        self.bids.truncate(self.depth)
+        self.asks.truncate(self.depth)
+        self.seq = seq
+        self.timestamp = timestamp
+        self.synced = True
+
+    def apply_update(self, bids, asks, seq, prev_seq, timestamp):
+        """Apply a delta in place and return the (bids, asks) levels that changed, or None on a sequence gap."""
+        if not self.synced or prev_seq != self.seq:
+            self.synced = False
+            return None
+        changed_bids = [[price, size] for price, size in bids if self.bids.set_level(price, size)]
+        changed_asks = [[price, size] for price, size in asks if self.asks.set_level(price, size)]
+        self.bids.truncate(self.depth)
+        self.asks.truncate(self.depth)
+        self.seq = seq
+        self.timestamp = timestamp
+        return changed_bids, changed_asks
+
+    def to_dict(self, depth=None):
+        # Same shape as a ccxt order book
+        return {
+            'symbol': self.symbol,
+            'bids': self.bids.levels(depth),
+            'asks': self.asks.levels(depth),
+            'timestamp': self.timestamp,
+            'datetime': iso8601(self.timestamp),
+            'nonce': self.seq
+        }
+
+
+def iso8601(timestamp_ms):
+    if timestamp_ms is None:
+        return None
+    dt = datetime.fromtimestamp(timestamp_ms // 1000, tz=timezone.utc)
+    return f"{dt.strftime('%Y-%m-%dT%H:%M:%S')}.{timestamp_ms % 1000:03d}Z"
@@ -0,0 +1,171 @@
+import argparse
+import numpy as np
+import os
+import sys
+from datetime import date, datetime, timezone
+from numpy.lib.format import open_memmap
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from core.base_app import MessageType
+from core.daily_gzip_json_reader import DailyGzipJsonReader
+from core.daily_msgpack_reader import DailyMsgpackReader
+
+LEVEL_COLUMNS = ('bid_price', 'bid_size', 'ask_price', 'ask_size')
+
+
+class OrderBookDay:
+    """One day of fixed-depth order books for an (exchange, symbol), memory-mapped column by column.
+
+    timestamps holds msg_time in nanoseconds; bid_price, bid_size, ask_price and ask_size are (snapshots, depth)
+    arrays with NaN where the book had fewer levels. Nothing is read from disk until a slice is touched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.timestamps = np.load(f"{path}/timestamps.npy", mmap_mode='r')
+        self.bid_price = np.load(f"{path}/bid_price.npy", mmap_mode='r')
+        self.bid_size = np.load(f"{path}/bid_size.npy", mmap_mode='r')
+        self.ask_price = np.load(f"{path}/ask_price.npy", mmap_mode='r')
+        self.ask_size = np.load(f"{path}/ask_size.npy", mmap_mode='r')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def depth(self):
+        return self.bid_price.shape[1]
+
+    def between(self, start_ns, end_ns):
+        # Snapshots are stored in msg_time order, so a time window is a contiguous slice
+        return slice(np.searchsorted(self.timestamps, start_ns, side='left'),
+                     np.searchsorted(self.timestamps, end_ns, side='right'))
+
+    def mid(self):
+        return (self.bid_price[:, 0] + self.ask_price[:, 0]) / 2
+
+    def spread(self):
+        return self.ask_price[:, 0] - self.bid_price[:, 0]
+
+    def imbalance(self, levels=1):
+        bid_size = np.nansum(self.bid_size[:, :levels], axis=1)
+        ask_size = np.nansum(self.ask_size[:, :levels], axis=1)
+        return (bid_size - ask_size) / (bid_size + ask_size)
+
+
+class _DayWriter:
+    """Appends snapshots to raw column files in chunks, then lays them out as .npy files on close."""
+
+    def __init__(self, path, depth, chunk_rows):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.depth = depth
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.timestamps = []
+        self.levels = np.full((chunk_rows, len(LEVEL_COLUMNS), depth), np.nan)
+        self.chunk_row = 0
+        self.raw_files = {column: open(f"{path}/{column}.raw", 'wb') for column in ('timestamps',) + LEVEL_COLUMNS}
+
+    def append(self, msg_time, bids, asks):
+        row = self.levels[self.chunk_row]
+        row.fill(np.nan)
+        bids = bids[:self.depth]
+        asks = asks[:self.depth]
+        if bids:
+            row[0:2, :len(bids)] = np.array([level[:2] for level in bids], dtype=np.float64).T
+        if asks:
+            row[2:4, :len(asks)] = np.array([level[:2] for level in asks], dtype=np.float64).T
+        self.timestamps.append(msg_time)
+        self.chunk_row += 1
+        if self.chunk_row == self.chunk_rows:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        np.array(self.timestamps, dtype=np.int64).tofile(self.raw_files['timestamps'])
+        for position, column in enumerate(LEVEL_COLUMNS):
+            np.ascontiguousarray(self.levels[:self.chunk_row, position, :]).tofile(self.raw_files[column])
+        self.rows += self.chunk_row
+        self.timestamps = []
+        self.chunk_row = 0
+
+    def close(self):
+        self._write_chunk()
+        for column, raw_file in self.raw_files.items():
+            raw_file.close()
+            raw_filename = f"{self.path}/{column}.raw"
+            if column == 'timestamps':
+                dtype, shape = np.int64, (self.rows,)
+            else:
+                dtype, shape = np.float64, (self.rows, self.depth)
+            array = open_memmap(f"{self.path}/{column}.npy", mode='w+', dtype=dtype, shape=shape)
+            if self.rows:
+                array[:] = np.memmap(raw_filename, dtype=dtype, mode='r', shape=shape)
+            array.flush()
+            del array
+            os.remove(raw_filename)
+
+
+class OrderBookStore:
+    """Columnar store of ORDER_BOOK snapshots laid out as {base_path}/{exchange}/{symbol}/{YYYY-MM-DD}/*.npy."""
+
+    def __init__(self, base_path, depth=10, chunk_rows=65536):
+        self.base_path = base_path.rstrip('/')  # Ensure no trailing slash
+        self.depth = depth
+        self.chunk_rows = chunk_rows
+
+    def _get_path(self, exchange, symbol, day):
+        return f"{self.base_path}/{exchange}/{symbol}/{day.strftime('%Y-%m-%d')}"
+
+    def load(self, exchange, symbol, day):
+        return OrderBookDay(self._get_path(exchange, symbol, day))
+
+    def convert(self, messages):
+        """Write every ORDER_BOOK message, in msg_time order, to its (exchange, symbol, day) columns."""
+        writers = {}
+        count = 0
+        try:
+            for message in messages:
+                if message['msg_type'] != MessageType.ORDER_BOOK.value:
+                    continue
+                msg_time = message['msg_time']
+                day = datetime.fromtimestamp(msg_time / 1e9, tz=timezone.utc).date()
+                key = (message['exchange'], message['symbol'])
+                writer_day, writer = writers.get(key, (None, None))
+                if writer_day != day:
+                    # A symbol's earlier day is complete once a later one starts
+                    if writer is not None:
+                        writer.close()
+                    writer = _DayWriter(self._get_path(*key, day), self.depth, self.chunk_rows)
+                    writers[key] = (day, writer)
+                writer.append(msg_time, message['data']['bids'], message['data']['asks'])
+                count += 1
+        finally:
+            for writer_day, writer in writers.values():
+                writer.close()
+        return count
+
+
+def _day_start_ns(value):
+    return int(datetime.combine(date.fromisoformat(value), datetime.min.time(), tzinfo=timezone.utc).timestamp()
+               ) * 1_000_000_000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert recorded order books into the columnar order book store")
+    parser.add_argument('--log-path', type=str, help='Directory holding the recorded message logs', required=True)
+    parser.add_argument('--log-filename', type=str, help='Base filename of the recorded message logs',
+                        default='message_log')
+    parser.add_argument('--log-format', type=str, choices=['json', 'msgpack'], help='Format of the recorded logs',
+                        default='json')
+    parser.add_argument('--store-path', type=str, help='Directory of the order book store', required=True)
+    parser.add_argument('--depth', type=int, help='Number of book levels to keep per side', default=10)
+    parser.add_argument('--start-date', type=str, help='First UTC day to convert, YYYY-MM-DD', required=True)
+    parser.add_argument('--end-date', type=str, help='Last UTC day to convert, YYYY-MM-DD', required=True)
+    args = parser.parse_args()
+
+    reader_class = DailyMsgpackReader if args.log_format == 'msgpack' else DailyGzipJsonReader
+    reader = reader_class(args.log_path, args.log_filename)
+    start_ns = _day_start_ns(args.start_date)
+    end_ns = _day_start_ns(args.end_date) + 86_400_000_000_000 - 1
+    converted = OrderBookStore(args.store_path, args.depth).convert(reader.read(start_ns, end_ns))
+    print(f"Converted {converted} order books into {args.store_path}")
@@ -0,0 +1,144 @@
+import heapq
+import multiprocessing
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from core.daily_gzip_json_reader import DailyGzipJsonReader
+from core.daily_msgpack_reader import DailyMsgpackReader
+
+DAY_NS = 86_400_000_000_000
+
+
+def _reordered(messages, window_ns):
+    # msg_time is not monotonic within a log, replies keep the msg_time of the message that triggered them; records
+    # are held until the newest msg_time seen is window_ns past them, so one arriving up to window_ns late is in order
+    pending = []
+    newest = None
+    for count, message in enumerate(messages):
+        msg_time = message['msg_time']
+        heapq.heappush(pending, (msg_time, count, message))
+        if newest is None or msg_time > newest:
+            newest = msg_time
+        while pending[0][0] < newest - window_ns:
+            yield heapq.heappop(pending)[2]
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
+def _read_stream(base_path, base_filename, log_format, start_ns, end_ns, chunk_size, chunks):
+    # Runs in a worker process: parse one day of one log and hand it over in chunks
+    try:
+        if log_format == 'msgpack':
+            reader = DailyMsgpackReader(base_path, base_filename)
+            messages = (dict(message) for message in reader.read(start_ns, end_ns))
+        else:
+            messages = DailyGzipJsonReader(base_path, base_filename).read(start_ns, end_ns)
+        chunk = []
+        for message in messages:
+            chunk.append(message)
+            if len(chunk) == chunk_size:
+                chunks.put(chunk)
+                chunk = []
+        if chunk:
+            chunks.put(chunk)
+        chunks.put(None)
+    except Exception as e:
+        chunks.put(e)
+
+
+class _Stream:
+    """One day of one log, parsed in its own process and consumed through a bounded queue of chunks."""
+
+    def __init__(self, context, source, start_ns, end_ns, chunk_size, prefetch_chunks):
+        self.context = context
+        self.args = source + (start_ns, end_ns, chunk_size)
+        self.prefetch_chunks = prefetch_chunks
+        self.chunks = None
+        self.process = None
+        self.started = False
+        self.finished = False
+
+    def start(self):
+        if not self.started:
+            self.chunks = self.context.Queue(maxsize=self.prefetch_chunks)
+            self.process = self.context.Process(target=_read_stream, args=self.args + (self.chunks,), daemon=True)
+            self.process.start()
+            self.started = True
+
+    def messages(self, on_finished):
+        self.start()
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+        self.process.join()
+        self.finished = True
+        on_finished()
+
+    def terminate(self):
+        if self.started and not self.finished:
+            self.process.terminate()
+            self.process.join()
+
+
+class ParallelLogReader:
+    """Reads several days and several logs in a process pool and merges them into one stream ordered by msg_time.
+
+    sources are (base_path, base_filename) or (base_path, base_filename, 'json' | 'msgpack') tuples, e.g. separate
+    gateway logs. Each (day, source) is parsed by its own worker process, at most processes at a time, and handed
+    over through a queue holding at most prefetch_chunks chunks, so memory stays bounded however long the range is.
+    Days are merged in order; within a day each source is first reordered through a window of reorder_window_ns,
+    since logs are written in sequence order and a record can be stamped earlier than the one logged before it, then
+    the sources are merged with a k-way heap merge. The output is in msg_time order as long as no record is logged
+    more than reorder_window_ns after a record stamped later than it; one that is comes out up to that late.
+    """
+
+    def __init__(self, sources, processes=None, chunk_size=10000, prefetch_chunks=4,
+                 reorder_window_ns=1_000_000_000):
+        self.sources = [tuple(source) + ('json',) * (3 - len(source)) for source in sources]
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.prefetch_chunks = prefetch_chunks
+        self.reorder_window_ns = reorder_window_ns
+
+    def read(self, start_ns, end_ns):
+        context = multiprocessing.get_context()
+        start_date = datetime.fromtimestamp(start_ns / 1e9, tz=timezone.utc).date()
+        end_date = datetime.fromtimestamp(end_ns / 1e9, tz=timezone.utc).date()
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+        streams = []
+        for day in days:
+            day_start_ns = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+            day_streams = [_Stream(context, source, max(start_ns, day_start_ns), min(end_ns, day_start_ns + DAY_NS - 1),
+                                   self.chunk_size, self.prefetch_chunks)
+                           for source in self.sources]
+            streams.append(day_streams)
+
+        def start_more():
+            # Keep the pool busy by prefetching later days in order
+            running = sum(1 for day_streams in streams for stream in day_streams
+                          if stream.started and not stream.finished)
+            for day_streams in streams:
+                for stream in day_streams:
+                    if running >= self.processes:
+                        return
+                    if not stream.started:
+                        stream.start()
+                        running += 1
+
+        try:
+            start_more()
+            for day_streams in streams:
+                yield from heapq.merge(*[_reordered(stream.messages(start_more), self.reorder_window_ns)
+                                         for stream in day_streams], key=itemgetter('msg_time'))
+        finally:
+            for day_streams in streams:
+                for stream in day_streams:
+                    stream.terminate()
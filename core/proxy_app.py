@@ -1,7 +1,6 @@
-import msgpack
 import zmq
 from abc import ABC, abstractmethod
-from base_app import BaseApp
+from base_app import BaseApp, Envelope
 from typing import final
 
 
@@ -14,17 +13,27 @@ class ProxyApp(BaseApp, ABC):
     async def post_start(self):
         self.subscriber_socket = self.zmq_context.socket(zmq.SUB)
         self.subscriber_socket.connect(self.config['ZeroMQ']['sub_endpoint'])
-        self.subscriber_socket.subscribe('')
+        # Topic prefixes to receive, e.g. "create_order|CDC|,cancel_order|CDC|"; everything when not configured
+        subscriptions = self.config.get('ZeroMQ', 'subscriptions', fallback='')
+        for topic in [topic.strip() for topic in subscriptions.split(',')]:
+            self.subscriber_socket.subscribe(topic)
 
     async def pre_stop(self):
         if self.subscriber_socket:
             self.subscriber_socket.close()
 
+    @final
+    async def receive_frames(self):
+        # The message frames as published, for apps that pass them on without decoding the payload
+        if self.subscriber_socket:
+            return await self.subscriber_socket.recv_multipart()
+        return None
+
     @final
     async def receive(self):
         if self.subscriber_socket:
-            message = await self.subscriber_socket.recv()
-            unpacked_msg = msgpack.unpackb(message, raw=False)
+            frames = await self.subscriber_socket.recv_multipart()
+            unpacked_msg = Envelope.from_frames(frames).unpack()
             self.virtual_time = unpacked_msg.get('msg_time', self.virtual_time)
             return unpacked_msg
         return None
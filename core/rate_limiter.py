@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# Priority classes, lower goes first when requests wait for the same endpoint
+CANCEL = 0
+AMEND = 1
+NEW = 2
+
+
+class TokenBucket:
+    """Allows rate requests per second on average and up to capacity back to back."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        # Seconds until a whole token is available
+        return max(1 - self.tokens, 0) / self.rate
+
+
+class EndpointStatistics:
+    __slots__ = ('granted', 'shed', 'waited', 'max_wait', 'started')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.granted = 0
+        self.shed = 0
+        self.waited = 0
+        self.max_wait = 0
+        self.started = time.monotonic()
+
+
+class RateLimiter:
+    """Token buckets per exchange endpoint, shared by every request a gateway sends.
+
+    A request that finds a token goes out at once; otherwise it waits, and waiting requests are served cancel
+    first, then amend, then new, each in arrival order. A new order is shed rather than queued when it is already
+    older than max_new_order_age_ms, or would be by the time a token is expected to free up for it. Endpoints
+    without a bucket are not limited.
+    """
+
+    def __init__(self, limits, max_new_order_age_ms=500):
+        self.buckets = {endpoint: TokenBucket(rate, capacity) for endpoint, (rate, capacity) in limits.items()}
+        self.max_new_order_age_ns = max_new_order_age_ms * 1_000_000
+        # endpoint -> heap of [priority, arrival, issued_ns, future]
+        self.waiters = {endpoint: [] for endpoint in self.buckets}
+        self.pumps = {}
+        self.arrivals = itertools.count()
+        self.statistics = {endpoint: EndpointStatistics() for endpoint in self.buckets}
+
+    @classmethod
+    def from_config(cls, section):
+        # endpoint = requests per second, burst; e.g. private/create-order = 150, 15
+        limits = {}
+        for endpoint, value in section.items():
+            if endpoint != 'max_new_order_age_ms':
+                rate, capacity = (float(part) for part in value.split(','))
+                limits[endpoint] = (rate, capacity)
+        return cls(limits, int(section.get('max_new_order_age_ms', 500)))
+
+    def try_acquire(self, endpoint):
+        """Take a token if one is free and no request is waiting for it, without waiting."""
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            return True
+        bucket.refill(time.monotonic())
+        if not self.waiters[endpoint] and bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.statistics[endpoint].granted += 1
+            return True
+        return False
+
+    async def acquire(self, endpoint, priority=NEW, issued_ns=None):
+        """Wait for a token for one request; returns False when a new order is shed instead."""
+        if self.try_acquire(endpoint):
+            return True
+        bucket = self.buckets[endpoint]
+        statistics = self.statistics[endpoint]
+        waiters = self.waiters[endpoint]
+        now = time.monotonic()
+
+        issued_ns = issued_ns or time.time_ns()
+        if priority == NEW:
+            # Every waiter is served before this one, at the bucket's rate
+            expected_wait_ns = (bucket.wait_time() + len(waiters) / bucket.rate) * 1_000_000_000
+            if time.time_ns() - issued_ns + expected_wait_ns > self.max_new_order_age_ns:
+                statistics.shed += 1
+                return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(waiters, [priority, next(self.arrivals), issued_ns, future])
+        if endpoint not in self.pumps:
+            self.pumps[endpoint] = asyncio.create_task(self._pump(endpoint))
+        granted = await future
+        if granted:
+            waited = time.monotonic() - now
+            statistics.waited += waited
+            statistics.max_wait = max(statistics.max_wait, waited)
+        return granted
+
+    async def _pump(self, endpoint):
+        # Hands out tokens to waiting requests as they refill, best priority first
+        bucket = self.buckets[endpoint]
+        statistics = self.statistics[endpoint]
+        waiters = self.waiters[endpoint]
+        try:
+            while waiters:
+                bucket.refill(time.monotonic())
+                if bucket.tokens < 1:
+                    await asyncio.sleep(bucket.wait_time())
+                    continue
+                priority, arrival, issued_ns, future = heapq.heappop(waiters)
+                if future.done():
+                    continue
+                if priority == NEW and time.time_ns() - issued_ns > self.max_new_order_age_ns:
+                    statistics.shed += 1
+                    future.set_result(False)
+                    continue
+                bucket.tokens -= 1
+                statistics.granted += 1
+                future.set_result(True)
+        finally:
+            del self.pumps[endpoint]
+
+    def utilisation(self):
+        """Per endpoint usage since the last call, as the share of the bucket's rate used, and reset it."""
+        report = {}
+        now = time.monotonic()
+        for endpoint, statistics in self.statistics.items():
+            if statistics.granted == 0 and statistics.shed == 0:
+                continue
+            bucket = self.buckets[endpoint]
+            elapsed = max(now - statistics.started, 1e-9)
+            report[endpoint] = {
+                'granted': statistics.granted,
+                'shed': statistics.shed,
+                'utilisation': round(statistics.granted / (bucket.rate * elapsed), 3),
+                'waiting': len(self.waiters[endpoint]),
+                'mean_wait_ms': round(statistics.waited / statistics.granted * 1000, 3) if statistics.granted else 0,
+                'max_wait_ms': round(statistics.max_wait * 1000, 3)
+            }
+            statistics.reset()
+        return report
@@ -3,26 +3,114 @@ import asyncio
 import msgpack
 import time
 import zmq
-from base_app import BaseApp, MessageType
-from collections import deque
+from base_app import STRATEGY_EVENT_TYPES, BaseApp, Envelope, MessageType, Subscription
+from collections import defaultdict, deque
+from journal import JournalReader, JournalWriter
+from metrics import LatencyHistogram
 
+CONTROL_MESSAGE_TYPES = (MessageType.CONNECT.value, MessageType.DISCONNECT.value)
 
-async def send_and_receive(req_socket, packed_message):
-    # Send the request
-    await req_socket.send(packed_message)
 
-    # Await the reply
-    reply = await req_socket.recv()
-    return reply  # Return the reply for later processing
+class ConflationQueue:
+    """FIFO of inbound messages where a newer ORDER_BOOK replaces the queued one for the same (exchange, symbol).
+
+    The replaced snapshot is dropped and the newer one joins the back of the queue, so it is never delivered ahead
+    of messages that arrived before it. Every other message type passes through untouched.
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.entries = deque()
+        self.books = {}
+        self.size = 0
+        self.dropped = 0
+        self.dropped_by_key = defaultdict(int)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, envelope):
+        entry = [envelope]
+        if self.enabled and envelope.msg_type == MessageType.ORDER_BOOK.value:
+            key = (envelope.exchange, envelope.symbol)
+            stale_entry = self.books.get(key)
+            if stale_entry is not None:
+                stale_entry[0] = None
+                self.size -= 1
+                self.dropped += 1
+                self.dropped_by_key[key] += 1
+            self.books[key] = entry
+        self.entries.append(entry)
+        self.size += 1
+
+    def peek(self):
+        self._skip_dropped()
+        return self.entries[0][0]
+
+    def popleft(self):
+        self._skip_dropped()
+        entry = self.entries.popleft()
+        envelope = entry[0]
+        if envelope.msg_type == MessageType.ORDER_BOOK.value:
+            key = (envelope.exchange, envelope.symbol)
+            if self.books.get(key) is entry:
+                del self.books[key]
+        self.size -= 1
+        return envelope
+
+    def _skip_dropped(self):
+        while self.entries[0][0] is None:
+            self.entries.popleft()
+
+
+class Connection:
+    """A strategy's REQ socket with its subscription, reply deadline and reply latency histogram."""
+
+    def __init__(self, connection_id, endpoint, req_socket, subscription, reply_timeout):
+        self.connection_id = connection_id
+        self.endpoint = endpoint
+        self.req_socket = req_socket
+        self.subscription = subscription
+        self.reply_timeout = reply_timeout
+        # Reply still outstanding after the deadline; the strategy is lagging until it arrives
+        self.pending_reply = None
+        # Past its deadline under the evict policy; nothing is routed to it until it sends CONNECT again
+        self.evicted = False
+        # Frames of the notices about this strategy that arrived while it was busy, sent once it is free
+        self.held_frames = []
+        self.delivery_task = None
+        self.latency = LatencyHistogram()
 
 
 class Sequencer(BaseApp):
     def __init__(self, config_file):
         super().__init__(config_file)
-        self.req_sockets = {}
+        self.connections = {}
+        # (msg_type, exchange, symbol) -> connection ids interested in it, rebuilt on connect and disconnect
+        self.routes = {}
         self.message_queue = deque()
         self.input_socket = None
         self.output_socket = None
+        # In batch mode everything queued on the PULL socket is shipped to each strategy in one REQ request
+        self.batch_mode = self.config.getboolean('Sequencer', 'batch_mode', fallback=False)
+        self.max_batch_size = self.config.getint('Sequencer', 'max_batch_size', fallback=1000)
+        # Under backlog a queued order book is replaced by a newer one for the same (exchange, symbol)
+        self.conflate_order_books = self.config.getboolean('Sequencer', 'conflate_order_books', fallback=False)
+        self.pending_messages = ConflationQueue(self.conflate_order_books)
+        self.stats_interval = self.config.getint('Sequencer', 'stats_interval_sec', fallback=60)
+        # Default reply deadline for a strategy, 0 waits forever; a strategy may ask for its own on CONNECT
+        self.reply_timeout_ms = self.config.getint('Sequencer', 'reply_timeout_ms', fallback=0)
+        # What to do with a strategy past its deadline: 'skip' it until it replies or 'evict' it until it reconnects
+        self.slow_strategy_policy = self.config.get('Sequencer', 'slow_strategy_policy', fallback='skip')
+        # Every sequenced message is journaled so late joiners can catch up; seq continues from the journal
+        self.journal = None
+        self.journal_reader = None
+        if self.config.has_section('Journal'):
+            journal_path = self.config['Journal']['path']
+            journal_filename = self.config['Journal']['filename']
+            self.journal = JournalWriter(journal_path, journal_filename)
+            self.journal_reader = JournalReader(journal_path, journal_filename)
+        self.seq = self.journal.last_seq() if self.journal else 0
 
     def _should_publish(self):
         return False
@@ -34,66 +122,285 @@ class Sequencer(BaseApp):
         self.output_socket.bind(self.config['ZeroMQ']['pub_endpoint'])
 
         task1 = asyncio.create_task(self.sequencing())
-        self.tasks.update({task1})
+        task2 = asyncio.create_task(self.report_statistics())
+        self.tasks.update({task1, task2})
+
+    async def receive_messages(self, block=True):
+        count = 0
+        if block:
+            self.stage_message(await self.input_socket.recv_multipart())
+            count += 1
+        if self.batch_mode or self.conflate_order_books:
+            # Drain whatever else is already queued without waiting for more
+            while count < self.max_batch_size:
+                try:
+                    frames = await self.input_socket.recv_multipart(flags=zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self.stage_message(frames)
+                count += 1
+
+    def stage_message(self, frames):
+        # Only the header is decoded here, the payload is passed through as received
+        try:
+            envelope = Envelope.from_frames(frames)
+            self.logger.debug(f"Received message with type: {envelope.msg_type}")
+        except Exception as e:
+            self.logger.error(f"Failed to unpack message: {e}")
+            return
+        if envelope.msg_type not in CONTROL_MESSAGE_TYPES:
+            envelope.msg_time = time.time_ns()
+        self.pending_messages.append(envelope)
 
     async def sequencing(self):
         while not self.shutdown_event.is_set():
             try:
-                message = await self.input_socket.recv()
-                unpacked_message = msgpack.unpackb(message, raw=False)
-                self.logger.debug(f"Received message with type: {unpacked_message.get('msg_type')}")
+                await self.receive_messages()
             except Exception as e:
-                self.logger.error(f"Failed to receive or unpack message: {e}")
+                self.logger.error(f"Failed to receive message: {e}")
                 continue
-            if unpacked_message.get('msg_type') == MessageType.CONNECT.value:
-                connection_id = unpacked_message['connection_id']
-                endpoint = f"{self.config['ZeroMQ']['req_endpoint_prefix']}_{connection_id}"
-                req_socket = self.zmq_context.socket(zmq.REQ)
-                req_socket.connect(endpoint)
-                self.req_sockets[connection_id] = req_socket
-                self.logger.info(f"Connected new request socket for connection_id: {connection_id}")
-            elif unpacked_message.get('msg_type') == MessageType.DISCONNECT.value:
-                connection_id = unpacked_message['connection_id']
-                req_socket = self.req_sockets.pop(connection_id, None)
-                if req_socket:
-                    req_socket.close()
-                    self.logger.info(f"Disconnected request socket for connection_id: {connection_id}")
+            while len(self.pending_messages) > 0:
+                await self.dispatch_pending()
+                # Pick up what arrived meanwhile so stale books can still be conflated
+                await self.receive_messages(block=False)
+            if self.journal:
+                self.journal.flush()
+
+    async def dispatch_pending(self):
+        envelope = self.pending_messages.popleft()
+        if envelope.msg_type == MessageType.CONNECT.value:
+            await self.connect(envelope.unpack())
+        elif envelope.msg_type == MessageType.DISCONNECT.value:
+            self.disconnect(envelope.unpack()['connection_id'])
+        else:
+            self.message_queue.append(envelope)
+            if self.batch_mode:
+                # Batch up to the next control message so connects and disconnects keep their place in the order
+                while len(self.message_queue) < self.max_batch_size and len(self.pending_messages) > 0:
+                    if self.pending_messages.peek().msg_type in CONTROL_MESSAGE_TYPES:
+                        break
+                    self.message_queue.append(self.pending_messages.popleft())
+            await self.dispatch()
+
+    async def connect(self, message):
+        connection_id = message['connection_id']
+        self.disconnect(connection_id)
+        endpoint = f"{self.config['ZeroMQ']['req_endpoint_prefix']}_{connection_id}"
+        req_socket = self.zmq_context.socket(zmq.REQ)
+        req_socket.connect(endpoint)
+        reply_timeout_ms = message.get('reply_timeout_ms') or self.reply_timeout_ms
+        self.connections[connection_id] = Connection(connection_id, endpoint, req_socket,
+                                                     Subscription(**(message.get('subscription') or {})),
+                                                     reply_timeout_ms / 1000 if reply_timeout_ms else None)
+        self.routes.clear()
+        self.logger.info(f"Connected new request socket for connection_id: {connection_id} with subscription: "
+                         f"{message.get('subscription')}")
+        if message.get('catch_up_seq') is not None and self.journal:
+            await self.catch_up(self.connections[connection_id], message['catch_up_seq'])
+
+    async def catch_up(self, connection, from_seq):
+        # Bridge the gap between what the strategy replayed from the journal itself and the live stream
+        self.journal.flush()
+        request_frames = []
+        count = 0
+        for seq, msg_time, header, payload in self.journal_reader.read(from_seq=from_seq, to_seq=self.seq):
+            envelope = Envelope.from_frames([header, payload])
+            if connection.subscription.matches(envelope.msg_type, envelope.exchange, envelope.symbol):
+                request_frames += [header, payload]
+                count += 1
+            if len(request_frames) >= 2 * self.max_batch_size:
+                # Replies to history are not sequenced; a strategy past its deadline is handled as in dispatch
+                if await self.send_and_receive(connection, request_frames, []) is None:
+                    self.logger.error(f"Catch up of {connection.connection_id} stopped at seq {seq}")
+                    return
+                request_frames = []
+        if request_frames and await self.send_and_receive(connection, request_frames, []) is None:
+            self.logger.error(f"Catch up of {connection.connection_id} stopped before seq {self.seq}")
+            return
+        self.logger.info(f"Caught up {connection.connection_id} with {count} messages from seq {from_seq}")
+
+    def disconnect(self, connection_id):
+        connection = self.connections.pop(connection_id, None)
+        self.routes.clear()
+        if connection:
+            if connection.delivery_task is not None:
+                connection.delivery_task.cancel()
+            if connection.pending_reply is not None:
+                connection.pending_reply.cancel()
+            connection.req_socket.close(linger=0)
+            self.logger.info(f"Disconnected request socket for connection_id: {connection_id}")
+
+    async def send_and_receive(self, connection, frames, notice_frames):
+        # Returns the strategy's replies, one list per message it was sent, or None when it did not reply in time
+        if connection.evicted or (connection.delivery_task is not None and not connection.delivery_task.done()):
+            self.hold_notices(connection, notice_frames)
+            return None
+        if connection.pending_reply is not None:
+            if not connection.pending_reply.done():
+                # Still working on an earlier request, so this message is skipped for it, but not its notices
+                self.hold_notices(connection, notice_frames)
+                return None
+            # The late reply is discarded, its replies would land out of sequence
+            connection.pending_reply = None
+            self.logger.warning(f"Strategy {connection.connection_id} recovered, discarded its late reply")
+            self.report_slow_strategy(MessageType.STRATEGY_RECOVERED, connection)
+
+        send_time = time.perf_counter_ns()
+        await connection.req_socket.send_multipart(frames)
+        reply = connection.req_socket.recv()
+        if connection.reply_timeout is not None:
+            # asyncio.wait leaves the receive pending on timeout rather than cancelling it
+            await asyncio.wait({reply}, timeout=connection.reply_timeout)
+        else:
+            await reply
+        connection.latency.record(time.perf_counter_ns() - send_time)
+        if reply.done():
+            return msgpack.unpackb(reply.result(), raw=False)
+
+        if self.slow_strategy_policy == 'evict':
+            # The socket is kept: another REQ socket would queue more requests on the same busy REP socket, which
+            # may then serve them out of order
+            connection.pending_reply = reply
+            connection.evicted = True
+            self.routes.clear()
+            self.logger.error(f"Strategy {connection.connection_id} missed its reply deadline, evicted until it "
+                              f"connects again")
+            self.report_slow_strategy(MessageType.STRATEGY_EVICTED, connection)
+        else:
+            connection.pending_reply = reply
+            self.logger.error(f"Strategy {connection.connection_id} missed its reply deadline, marked lagging")
+            self.report_slow_strategy(MessageType.STRATEGY_LAGGING, connection)
+        return None
+
+    def hold_notices(self, connection, notice_frames):
+        connection.held_frames += notice_frames
+        if connection.held_frames and (connection.delivery_task is None or connection.delivery_task.done()):
+            connection.delivery_task = asyncio.create_task(self.deliver_notices(connection))
+
+    async def deliver_notices(self, connection):
+        # A strategy past its deadline gets its notices once it is done with the late request, so it can reset its
+        # pending state, and connect again when evicted; replies to them are not sequenced
+        while connection.held_frames:
+            await asyncio.wait({connection.pending_reply})
+            frames, connection.held_frames = connection.held_frames, []
+            await connection.req_socket.send_multipart(frames)
+            connection.pending_reply = connection.req_socket.recv()
+
+    def report_slow_strategy(self, msg_type, connection):
+        # Sequenced like any other message so subscribers and the logger see when a strategy misses messages
+        envelope = Envelope.from_message({
+            'msg_type': msg_type.value,
+            'connection_id': connection.connection_id,
+            'data': {
+                'reply_timeout_ms': round(connection.reply_timeout * 1000),
+                'policy': self.slow_strategy_policy
+            }
+        })
+        envelope.msg_time = time.time_ns()
+        self.message_queue.append(envelope)
+
+    async def report_statistics(self):
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(self.stats_interval)
+            self.log_statistics()
+
+    def log_statistics(self):
+        if self.conflate_order_books:
+            self.logger.info(f"Conflated {self.pending_messages.dropped} order books: "
+                             f"{dict(self.pending_messages.dropped_by_key)}")
+        for connection in self.connections.values():
+            if connection.latency.count > 0:
+                self.logger.info(f"Reply latency for {connection.connection_id}: {connection.latency.summary()}")
+                connection.latency.reset()
+
+    def route(self, envelope):
+        key = (envelope.msg_type, envelope.exchange, envelope.symbol)
+        connection_ids = self.routes.get(key)
+        if connection_ids is None:
+            connection_ids = tuple(connection_id for connection_id, connection in self.connections.items()
+                                   if not connection.evicted and connection.subscription.matches(*key))
+            self.routes[key] = connection_ids
+        return connection_ids
+
+    async def dispatch(self):
+        while len(self.message_queue) > 0:
+            if self.batch_mode:
+                batch_size = min(len(self.message_queue), self.max_batch_size)
+                batch = [self.message_queue.popleft() for _ in range(batch_size)]
             else:
-                msg_time = time.time_ns()
-
-                self.message_queue.append(unpacked_message)
-                while len(self.message_queue) > 0:
-                    queued_message = self.message_queue.popleft()
-                    queued_message['msg_time'] = msg_time
-                    try:
-                        packed_message = msgpack.packb(queued_message)
-                        # Create a list of coroutines for each REQ socket
-                        tasks = [send_and_receive(req_socket, packed_message) for req_socket in
-                                 self.req_sockets.values()]
-
-                        # Run the coroutines concurrently and collect replies in order
-                        replies = await asyncio.gather(*tasks)
-
-                        # Process replies in order
-                        for reply in replies:
-                            unpacked_replies = msgpack.unpackb(reply, raw=False)
-                            if len(unpacked_replies) > 0:
-                                for unpacked_reply in unpacked_replies:
-                                    self.message_queue.append(unpacked_reply)
-
-                        await self.output_socket.send(packed_message)
-                        self.logger.debug(f"Dispatched message with type: {queued_message.get('msg_type')}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to process or dispatch message: {e}")
+                batch = [self.message_queue.popleft()]
+            try:
+                # Stamp the sequence number and pack each header once for the strategies and the publisher
+                frames = []
+                for queued_envelope in batch:
+                    self.seq += 1
+                    queued_envelope.seq = self.seq
+                    message_frames = queued_envelope.frames()
+                    frames.append(message_frames)
+                    if self.journal:
+                        self.journal.write(self.seq, queued_envelope.msg_time, *message_frames)
+
+                # Each strategy only receives the messages it subscribed to, in sequence order
+                requested_indices = {}
+                notice_indices = {}
+                for index, queued_envelope in enumerate(batch):
+                    for connection_id in self.route(queued_envelope):
+                        requested_indices.setdefault(connection_id, []).append(index)
+                    if queued_envelope.msg_type in STRATEGY_EVENT_TYPES:
+                        # The strategy concerned hears about it whatever its subscription
+                        connection_id = queued_envelope.unpack()['connection_id']
+                        if connection_id in self.connections:
+                            notice_indices.setdefault(connection_id, []).append(index)
+                            indices = requested_indices.setdefault(connection_id, [])
+                            if index not in indices:
+                                indices.append(index)
+                connection_ids = [connection_id for connection_id in self.connections
+                                  if connection_id in requested_indices]
+
+                # Create a list of coroutines for each interested REQ socket
+                tasks = []
+                for connection_id in connection_ids:
+                    request_frames = [frame for index in requested_indices[connection_id] for frame in frames[index]]
+                    notice_frames = [frame for index in notice_indices.get(connection_id, ())
+                                     for frame in frames[index]]
+                    tasks.append(self.send_and_receive(self.connections[connection_id], request_frames, notice_frames))
+
+                # Run the coroutines concurrently and collect replies in order
+                replies = await asyncio.gather(*tasks)
+
+                # A reply holds one list of (header, payload) replies per message the strategy was sent
+                replies_by_message = [[] for _ in batch]
+                for connection_id, reply in zip(connection_ids, replies):
+                    if reply is None:
                         continue
+                    for index, strategy_replies in zip(requested_indices[connection_id], reply):
+                        replies_by_message[index].append(strategy_replies)
+
+                # Process replies in message order, then in strategy order
+                for queued_envelope, message_replies in zip(batch, replies_by_message):
+                    for strategy_replies in message_replies:
+                        for reply_frames in strategy_replies:
+                            reply_envelope = Envelope.from_frames(reply_frames)
+                            reply_envelope.msg_time = queued_envelope.msg_time
+                            self.message_queue.append(reply_envelope)
+
+                for queued_envelope, message_frames in zip(batch, frames):
+                    # Topic first, so subscribers drop what they do not want inside ZeroMQ
+                    await self.output_socket.send_multipart([queued_envelope.topic()] + message_frames)
+                    self.logger.debug(f"Dispatched message with type: {queued_envelope.msg_type}")
+            except Exception as e:
+                self.logger.error(f"Failed to process or dispatch message: {e}")
+                continue
 
     async def pre_stop(self):
+        self.log_statistics()
         try:
-            for socket in self.req_sockets.values():
-                socket.close()
-            self.req_sockets.clear()
+            for connection_id in list(self.connections):
+                self.disconnect(connection_id)
             self.output_socket.close()
             self.input_socket.close()
+            if self.journal:
+                self.journal.close()
             self.logger.info("Closed all sockets successfully during pre_stop.")
         except Exception as e:
             self.logger.error(f"An error occurred during pre_stop: {e}")
@@ -1,8 +1,227 @@
 import asyncio
+import bisect
 import msgpack
 import zmq
-from abc import ABC, abstractmethod
-from core.base_app import BaseApp, MessageType
+from abc import ABC
+from datetime import datetime, timezone
+from core.base_app import STRATEGY_EVENT_TYPES, BaseApp, Envelope, MessageType, Subscription
+from core.journal import JournalReader
+
+
+def _split_list(value):
+    if not value:
+        return None
+    return [item.strip() for item in value.split(',')]
+
+
+# ccxt order statuses after which an order no longer rests on the book
+CLOSED_STATUSES = ('closed', 'canceled', 'expired', 'rejected')
+
+
+class OpenOrders:
+    """A strategy's resting orders by client order id and by side and price level, with their pending states.
+
+    Price levels are kept sorted per side, so the lowest and highest priced orders are found without scanning or
+    sorting, and orders at one level keep their arrival order. pending_new holds orders sent but not yet seen in an
+    order update, pending_cancel those with a cancel in flight. Orders whose client order id does not start with
+    the prefix belong to someone else and are ignored.
+    """
+
+    def __init__(self, client_order_id_prefix=''):
+        self.client_order_id_prefix = client_order_id_prefix
+        self.orders = {}
+        self.pending_new = set()
+        self.pending_cancel = set()
+        # side -> distinct prices ascending, (side, price) -> {client_order_id: order} in arrival order
+        self.prices = {'BUY': [], 'SELL': []}
+        self.levels = {}
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, client_order_id):
+        return client_order_id in self.orders
+
+    def __iter__(self):
+        return iter(list(self.orders))
+
+    def get(self, client_order_id):
+        return self.orders.get(client_order_id)
+
+    def owns(self, client_order_id):
+        # Ids already tracked skip the prefix check
+        return client_order_id is not None and (
+                client_order_id in self.orders or client_order_id in self.pending_new or
+                client_order_id.startswith(self.client_order_id_prefix))
+
+    def add_pending_new(self, client_order_id):
+        self.pending_new.add(client_order_id)
+
+    def add_pending_cancel(self, client_order_id):
+        # False when a cancel is already in flight for the order
+        if client_order_id in self.pending_cancel:
+            return False
+        self.pending_cancel.add(client_order_id)
+        return True
+
+    def update(self, order):
+        """Apply a ccxt order update; returns False when the order is not ours."""
+        client_order_id = order.get('clientOrderId')
+        if not self.owns(client_order_id):
+            return False
+        if order['status'] == 'open':
+            self._remove(client_order_id)
+            self._insert(client_order_id, order)
+        elif order['status'] in CLOSED_STATUSES:
+            self._remove(client_order_id)
+            self.pending_cancel.discard(client_order_id)
+        self.pending_new.discard(client_order_id)
+        return True
+
+    def reject_new(self, client_order_id):
+        # True when the rejected order was pending new
+        if client_order_id in self.pending_new:
+            self.pending_new.discard(client_order_id)
+            return True
+        return False
+
+    def clear_pending(self):
+        self.pending_new.clear()
+        self.pending_cancel.clear()
+
+    def reject_cancel(self, client_order_id):
+        # The order is still open, so it may be cancelled again
+        self.pending_cancel.discard(client_order_id)
+
+    def lowest(self, side):
+        prices = self.prices[side.upper()]
+        return next(iter(self.levels[side.upper(), prices[0]].values())) if prices else None
+
+    def highest(self, side):
+        prices = self.prices[side.upper()]
+        return next(iter(self.levels[side.upper(), prices[-1]].values())) if prices else None
+
+    def best(self, side):
+        # The most aggressive order: highest buy or lowest sell
+        return self.highest(side) if side.upper() == 'BUY' else self.lowest(side)
+
+    def by_price(self, side, descending=False):
+        side = side.upper()
+        prices = reversed(self.prices[side]) if descending else self.prices[side]
+        return [order for price in prices for order in self.levels[side, price].values()]
+
+    def _insert(self, client_order_id, order):
+        side, price = order['side'].upper(), order['price']
+        level = self.levels.get((side, price))
+        if level is None:
+            level = self.levels[side, price] = {}
+            bisect.insort(self.prices[side], price)
+        level[client_order_id] = order
+        self.orders[client_order_id] = order
+
+    def _remove(self, client_order_id):
+        order = self.orders.pop(client_order_id, None)
+        if order is None:
+            return
+        side, price = order['side'].upper(), order['price']
+        level = self.levels[side, price]
+        del level[client_order_id]
+        if not level:
+            del self.levels[side, price]
+            prices = self.prices[side]
+            del prices[bisect.bisect_left(prices, price)]
+
+
+class Message:
+    """A routed message: header fields as attributes, the payload decoded only when its data is first read.
+
+    Handlers that act on msg_type, exchange, symbol or msg_time alone never pay for decoding the payload.
+    """
+    __slots__ = ('msg_type', 'exchange', 'symbol', 'seq', 'msg_time', '_envelope', '_message')
+
+    def __init__(self, msg_type, exchange, symbol, seq, msg_time, envelope=None, message=None):
+        self.msg_type = msg_type
+        self.exchange = exchange
+        self.symbol = symbol
+        self.seq = seq
+        self.msg_time = msg_time
+        self._envelope = envelope
+        self._message = message
+
+    @classmethod
+    def from_envelope(cls, envelope):
+        return cls(envelope.msg_type, envelope.exchange, envelope.symbol, envelope.seq, envelope.msg_time,
+                   envelope=envelope)
+
+    @classmethod
+    def from_dict(cls, message):
+        return cls(message.get('msg_type'), message.get('exchange'), message.get('symbol'), message.get('seq'),
+                   message.get('msg_time'), message=message)
+
+    def to_dict(self):
+        if self._message is None:
+            self._message = self._envelope.unpack()
+        return self._message
+
+    @property
+    def data(self):
+        return self.to_dict().get('data')
+
+
+class OrderBookMessage(Message):
+    __slots__ = ()
+
+    @property
+    def bids(self):
+        return self.data['bids']
+
+    @property
+    def asks(self):
+        return self.data['asks']
+
+    @property
+    def best_bid(self):
+        # [price, amount] or None when the side is empty
+        bids = self.data['bids']
+        return bids[0] if bids else None
+
+    @property
+    def best_ask(self):
+        asks = self.data['asks']
+        return asks[0] if asks else None
+
+
+class OrderUpdateMessage(Message):
+    __slots__ = ()
+
+    @property
+    def client_order_id(self):
+        return self.data.get('clientOrderId')
+
+    @property
+    def status(self):
+        return self.data['status']
+
+
+class RejectMessage(Message):
+    """A create or cancel instruction sent back by a gateway that could not execute it."""
+    __slots__ = ()
+
+    @property
+    def client_order_id(self):
+        return self.data.get('params', {}).get('clientOrderId')
+
+    @property
+    def order_id(self):
+        return self.data.get('id')
+
+
+MESSAGE_CLASSES = {
+    MessageType.ORDER_BOOK.value: OrderBookMessage,
+    MessageType.ORDER_UPDATE.value: OrderUpdateMessage,
+    MessageType.CREATE_ORDER_REJECT.value: RejectMessage,
+    MessageType.CANCEL_ORDER_REJECT.value: RejectMessage
+}
 
 
 class Strategy(BaseApp, ABC):
@@ -13,6 +232,12 @@ class Strategy(BaseApp, ABC):
         self.endpoint_prefix = self.config['ZeroMQ']['rep_endpoint_prefix']
         self.rep_socket = None
         self.replies = []
+        # (msg_type, exchange, symbol) -> handler, None matching any exchange or symbol, see on()
+        self.handlers = {}
+        # Last sequenced message received, where the sequencer's catch up starts when reconnecting
+        self.last_seq = None
+        self.last_event_seq = 0
+        self.reconnect_task = None
 
     async def post_start(self):
         self.rep_socket = self.zmq_context.socket(zmq.REP)
@@ -20,27 +245,148 @@ class Strategy(BaseApp, ABC):
         self.rep_socket.bind(endpoint)
         self.logger.info(f"REP socket bound to {endpoint} for connection_id: {self.connection_id}")
 
+        # Rebuild state from the sequencer's journal first, the sequencer sends whatever was sequenced since
+        catch_up_seq = None
+        if self.config.has_section('Journal'):
+            catch_up_seq = self.catch_up(self.config.getint('Journal', 'catch_up_from_seq', fallback=None))
+
+        await self.connect(catch_up_seq)
+        self.tasks.update({asyncio.create_task(self.request_and_reply())})
+
+    async def connect(self, catch_up_seq=None):
         # Send connect message
         connect_message = {
             'msg_type': MessageType.CONNECT.value,
-            'connection_id': self.connection_id
+            'connection_id': self.connection_id,
+            'subscription': self.subscription(),
+            'reply_timeout_ms': self.config.getint('ZeroMQ', 'reply_timeout_ms', fallback=None),
+            'catch_up_seq': catch_up_seq
         }
         await self.send(connect_message)
-        self.tasks.update({asyncio.create_task(self.request_and_reply())})
 
     async def request_and_reply(self):
         while not self.shutdown_event.is_set():
-            self.replies.clear()
-            message = await self.rep_socket.recv()
-            request = msgpack.unpackb(message, raw=False)
-            self.logger.debug(f"Received request: {request}")
-            self.virtual_time = request.get('msg_time', self.virtual_time)
-            self.handle_request(request)
-            self.logger.debug(f"Sending replies: {self.replies}")
-            await self.rep_socket.send(msgpack.packb(self.replies))
-
-    @abstractmethod
+            frames = await self.rep_socket.recv_multipart()
+            # A request carries one (header, payload) frame pair per message, several when batched
+            replies = []
+            for index in range(0, len(frames), 2):
+                envelope = Envelope.from_frames(frames[index:index + 2])
+                self.logger.debug(f"Received request with type: {envelope.msg_type}")
+                if envelope.msg_type in STRATEGY_EVENT_TYPES:
+                    self.handle_strategy_event(envelope.unpack())
+                elif envelope.seq is not None:
+                    self.last_seq = envelope.seq
+                replies.append([Envelope.from_message(reply).frames() for reply in self.process_envelope(envelope)])
+            self.logger.debug(f"Sending replies: {replies}")
+            await self.rep_socket.send(msgpack.packb(replies))
+
+    def catch_up(self, from_seq=None):
+        reader = JournalReader(self.config['Journal']['path'], self.config['Journal']['filename'])
+        if from_seq is None:
+            # Today's history by default, not every journal on disk
+            from_seq = reader.day_start_seq(datetime.now(timezone.utc).date())
+        subscription = Subscription(**(self.subscription() or {}))
+        next_seq = from_seq
+        count = 0
+        for seq, msg_time, header, payload in reader.read(from_seq=from_seq):
+            envelope = Envelope.from_frames([header, payload])
+            if subscription.matches(envelope.msg_type, envelope.exchange, envelope.symbol):
+                # Replies to history were already sequenced by the previous run, so they are dropped
+                self.process_envelope(envelope)
+                count += 1
+            self.last_seq = seq
+            next_seq = seq + 1
+        self.replies = []
+        self.logger.info(f"Replayed {count} journaled messages from seq {from_seq} to {next_seq - 1}")
+        return next_seq
+
+    def handle_strategy_event(self, event):
+        # Replies around a missed deadline were dropped, so what this strategy waits on may never be acknowledged
+        if event.get('connection_id') != self.connection_id or (event.get('seq') or 0) <= self.last_event_seq:
+            return
+        self.last_event_seq = event.get('seq') or 0
+        self.logger.warning(f"Sequencer reported {event['msg_type']} for this strategy, resetting pending state")
+        self.reset_pending_state()
+        if event['msg_type'] == MessageType.STRATEGY_EVICTED.value:
+            # Nothing is routed here until CONNECT; the sequencer replays what was missed when it keeps a journal
+            catch_up_seq = self.last_seq + 1 if self.last_seq is not None else None
+            self.reconnect_task = asyncio.create_task(self.connect(catch_up_seq))
+            # Tracked with the app's tasks so stop() cancels it, and dropped from them once done
+            self.tasks.add(self.reconnect_task)
+            self.reconnect_task.add_done_callback(self.reconnect_done)
+
+    def reconnect_done(self, task):
+        self.tasks.discard(task)
+        if self.reconnect_task is task:
+            self.reconnect_task = None
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"Reconnecting {self.connection_id} failed: {task.exception()}")
+
+    def reset_pending_state(self):
+        """Called when the sequencer reports this strategy missed its reply deadline.
+
+        Messages were skipped and replies dropped meanwhile, so orders pending new or cancel may never be
+        acknowledged; a strategy that waits on them clears them here.
+        """
+        pass
+
+    def on(self, msg_type, handler, exchange=None, symbol=None):
+        """Route msg_type messages, for one exchange and symbol when given, to handler(message).
+
+        The handler gets a Message, or its subclass for the msg_type in MESSAGE_CLASSES; the most specific
+        registration wins. Messages without a handler go to handle_request as a dict.
+        """
+        msg_type = msg_type.value if isinstance(msg_type, MessageType) else msg_type
+        self.handlers[msg_type, exchange, symbol] = handler
+
+    def find_handler(self, msg_type, exchange, symbol):
+        handlers = self.handlers
+        if not handlers:
+            return None
+        return (handlers.get((msg_type, exchange, symbol)) or handlers.get((msg_type, exchange, None)) or
+                handlers.get((msg_type, None, symbol)) or handlers.get((msg_type, None, None)))
+
+    def process_envelope(self, envelope):
+        self.replies = []
+        if envelope.msg_time is not None:
+            self.virtual_time = envelope.msg_time
+        handler = self.find_handler(envelope.msg_type, envelope.exchange, envelope.symbol)
+        try:
+            if handler is None:
+                self.handle_request(envelope.unpack())
+            else:
+                handler(MESSAGE_CLASSES.get(envelope.msg_type, Message).from_envelope(envelope))
+        except Exception as e:
+            self.logger.error(f"Failed to handle message: {e}", exc_info=True)
+        return self.replies
+
+    def process_request(self, request):
+        # The same as process_envelope for a message that is already a dict, as in a backtest
+        self.replies = []
+        self.virtual_time = request.get('msg_time', self.virtual_time)
+        handler = self.find_handler(request.get('msg_type'), request.get('exchange'), request.get('symbol'))
+        try:
+            if handler is None:
+                self.handle_request(request)
+            else:
+                handler(MESSAGE_CLASSES.get(request.get('msg_type'), Message).from_dict(request))
+        except Exception as e:
+            self.logger.error(f"Failed to handle message: {e}", exc_info=True)
+        return self.replies
+
+    def subscription(self):
+        # Filter the sequencer routes by: exchange, symbols and msg_types; None means every message
+        if not self.config.has_section('Subscription'):
+            return None
+        section = self.config['Subscription']
+        return {
+            'exchange': section.get('exchange'),
+            'symbols': _split_list(section.get('symbols')),
+            'msg_types': _split_list(section.get('msg_types'))
+        }
+
     def handle_request(self, request):
+        # Messages no handler was registered for, as a dict; dropped unless a subclass overrides this
         pass
 
     async def pre_stop(self):
@@ -5,7 +5,7 @@ import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from core.base_app import MessageType
-from core.strategy import Strategy
+from core.strategy import OpenOrders, Strategy
 
 
 class OptiTrade(Strategy):
@@ -22,80 +22,71 @@ class OptiTrade(Strategy):
         self.sequence_number = 0
         self.order_book = None
         self.last_order_time = None
-        self.open_orders = {}
-        self.pending_new = set()
-        self.pending_cancel = set()
-
-    def handle_request(self, request):
-        try:
-            if request.get('exchange') == self.exchange:
-                if request['msg_type'] == MessageType.ORDER_BOOK.value:
-                    if request.get('symbol') == self.symbol:
-                        self.order_book = request['data']
-                        self.manage_orders()
-                elif request['msg_type'] == MessageType.ORDER_UPDATE.value:
-                    order = request['data']
-                    client_order_id = order['clientOrderId']
-                    if client_order_id.startswith(self.client_order_id_prefix):
-                        if order['status'] == 'open':
-                            # Add or update the order in the open_orders dict
-                            self.open_orders[client_order_id] = order
-                        elif order['status'] in ['closed', 'canceled', 'expired', 'rejected']:
-                            # Remove the order from open_orders
-                            if client_order_id in self.open_orders:
-                                del self.open_orders[client_order_id]
-                            # Remove from pending_cancel if it's confirmed by the exchange
-                            if client_order_id in self.pending_cancel:
-                                self.pending_cancel.discard(client_order_id)
-                                self.logger.info(f"Order {client_order_id} removed from pending_cancel.")
-
-                        # Remove from pending_new if it's confirmed by the exchange
-                        if client_order_id in self.pending_new:
-                            self.pending_new.discard(client_order_id)
-                            self.logger.info(f"Order {client_order_id} removed from pending_new.")
-                elif request['msg_type'] == MessageType.CREATE_ORDER_REJECT.value:
-                    order = request['data']
-                    client_order_id = order['params']['clientOrderId']
-                    if client_order_id.startswith(self.client_order_id_prefix):
-                        if client_order_id in self.pending_new:
-                            self.pending_new.discard(client_order_id)
-                            self.logger.info(f"Order {client_order_id} removed from pending_new due to rejection.")
-
-        except Exception as e:
-            self.logger.error(f"Failed to handle message: {e}", exc_info=True)
+        self.orders = OpenOrders(self.client_order_id_prefix)
+        self.on(MessageType.ORDER_BOOK, self.on_order_book, self.exchange, self.symbol)
+        self.on(MessageType.ORDER_UPDATE, self.on_order_update, self.exchange)
+        self.on(MessageType.CREATE_ORDER_REJECT, self.on_create_order_reject, self.exchange)
+        self.on(MessageType.CANCEL_ORDER_REJECT, self.on_cancel_order_reject, self.exchange)
+
+    def subscription(self):
+        return {
+            'exchange': self.exchange,
+            'symbols': [self.symbol],
+            'msg_types': [MessageType.ORDER_BOOK.value, MessageType.ORDER_UPDATE.value,
+                          MessageType.CREATE_ORDER_REJECT.value, MessageType.CANCEL_ORDER_REJECT.value]
+        }
+
+    def on_order_book(self, message):
+        self.order_book = message
+        self.manage_orders()
+
+    def on_order_update(self, message):
+        # Indexes open orders and clears pending new and pending cancel once the exchange confirms
+        if self.orders.update(message.data):
+            self.logger.info(f"Order {message.client_order_id} is {message.status}.")
+
+    def on_create_order_reject(self, message):
+        client_order_id = message.client_order_id
+        if self.orders.reject_new(client_order_id):
+            self.logger.info(f"Order {client_order_id} removed from pending_new due to rejection.")
+
+    def on_cancel_order_reject(self, message):
+        # The order is still open, so a later tick may cancel it again
+        client_order_id = message.client_order_id
+        if client_order_id in self.orders.pending_cancel:
+            self.orders.reject_cancel(client_order_id)
+            self.logger.info(f"Order {client_order_id} removed from pending_cancel due to rejection.")
+
+    def reset_pending_state(self):
+        # Acknowledgements for orders sent before the missed deadline may never arrive
+        self.orders.clear_pending()
 
     def manage_orders(self):
         # Check if it's time to place a new order or if no order has been sent before
         if (self.last_order_time is None or (
                 self.virtual_time - self.last_order_time) >= self.sleep_time) and self.order_book:
-            # Filter orders with the same client_order_id_prefix and sort them by price descendingly
-            filtered_sorted_orders = sorted(
-                [order for order in self.open_orders.values() if
-                 order['clientOrderId'].startswith(self.client_order_id_prefix)],
-                key=lambda o: float(o['price']),
-                reverse=True
-            )
-
-            # Cancel all but the last order
-            for order in filtered_sorted_orders[:-1]:
-                self.try_cancel_order(order['clientOrderId'])
+            # Keep the lowest priced order and cancel all others
+            last_order = self.orders.lowest(self.order_side)
+            for client_order_id in self.orders:
+                if last_order is None or client_order_id != last_order['clientOrderId']:
+                    self.try_cancel_order(client_order_id)
 
             # Cancel the last order if it exists and is not at the top of the book
-            if len(filtered_sorted_orders) > 0:
-                last_order_price = filtered_sorted_orders[-1]['price']
+            if last_order is not None:
+                last_order_price = last_order['price']
                 if self.order_side == 'SELL':
-                    target_price = self.order_book['asks'][0][0] if self.order_book['asks'] else None
+                    target_price = self.order_book.best_ask[0] if self.order_book.best_ask else None
                     if self.limit_price > 0:
                         target_price = max(target_price, self.limit_price)
                 elif self.order_side == 'BUY':
-                    target_price = self.order_book['bids'][0][0] if self.order_book['bids'] else None
+                    target_price = self.order_book.best_bid[0] if self.order_book.best_bid else None
                     if self.limit_price > 0:
                         target_price = min(target_price, self.limit_price)
                 else:
                     target_price = None
 
                 if target_price is not None and last_order_price != target_price:
-                    self.try_cancel_order(filtered_sorted_orders[-1]['clientOrderId'])
+                    self.try_cancel_order(last_order['clientOrderId'])
                     self.logger.info("Placing a new order after cancellation.")
                     # Place a new order
                     self.try_place_order()
@@ -107,13 +98,12 @@ class OptiTrade(Strategy):
                 self.last_order_time = self.virtual_time
 
     def try_cancel_order(self, client_order_id):
-        if client_order_id in self.pending_cancel:
+        # Add to pending_cancel unless a cancel is already in flight
+        if not self.orders.add_pending_cancel(client_order_id):
             self.logger.info(f"Order {client_order_id} is already pending cancellation, skipping.")
             return
 
         try:
-            # Add to pending_cancel list
-            self.pending_cancel.add(client_order_id)
             self.logger.info(f"Order {client_order_id} added to pending_cancel and cancellation request is being sent.")
             self.cancel_order(self.exchange, self.symbol, client_order_id)
             self.logger.info(f"Order {client_order_id} cancellation request sent.")
@@ -122,7 +112,7 @@ class OptiTrade(Strategy):
 
     def try_place_order(self):
         # Do not place a new order if there are pending new orders
-        if self.pending_new:
+        if self.orders.pending_new:
             self.logger.info("New order placement is deferred due to pending new orders.")
             return
 
@@ -131,13 +121,13 @@ class OptiTrade(Strategy):
         # Determine price based on execution mode
         if self.exec_mode == 'TOB':
             # Use top of book price for sell side
-            if self.order_side == 'SELL' and self.order_book and self.order_book['asks']:
-                price = float(self.order_book['asks'][0][0])
+            if self.order_side == 'SELL' and self.order_book and self.order_book.best_ask:
+                price = float(self.order_book.best_ask[0])
                 # Floor the sell price at limit_price if it's set
                 if self.limit_price > 0:
                     price = max(price, self.limit_price)
-            elif self.order_side == 'BUY' and self.order_book and self.order_book['bids']:
-                price = float(self.order_book['bids'][0][0])
+            elif self.order_side == 'BUY' and self.order_book and self.order_book.best_bid:
+                price = float(self.order_book.best_bid[0])
                 # Cap the buy price at limit_price if it's set
                 if self.limit_price > 0:
                     price = min(price, self.limit_price)
@@ -145,8 +135,8 @@ class OptiTrade(Strategy):
                 price = None
         elif self.exec_mode == 'MID':
             # Calculate mid price
-            best_bid = float(self.order_book['bids'][0][0]) if self.order_book and self.order_book['bids'] else None
-            best_ask = float(self.order_book['asks'][0][0]) if self.order_book and self.order_book['asks'] else None
+            best_bid = float(self.order_book.best_bid[0]) if self.order_book and self.order_book.best_bid else None
+            best_ask = float(self.order_book.best_ask[0]) if self.order_book and self.order_book.best_ask else None
             if best_bid and best_ask:
                 price = (best_bid + best_ask) / 2
                 if self.order_side == 'SELL':
@@ -169,7 +159,7 @@ class OptiTrade(Strategy):
 
         try:
             # Add to pending_new list
-            self.pending_new.add(client_order_id)
+            self.orders.add_pending_new(client_order_id)
             self.logger.info(
                 f"Order {client_order_id} added to pending_new and a new {self.order_side} order placement request is "
                 f"being sent at price: {price}")
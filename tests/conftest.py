@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Core modules import each other by bare name when run as apps, and as core.* from offline tools and strategies
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'core'))
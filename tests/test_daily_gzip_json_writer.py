@@ -0,0 +1,54 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from daily_gzip_json_reader import DailyGzipJsonReader
+from daily_gzip_json_writer import DailyGzipJsonWriter
+
+MIDNIGHT_NS = int(datetime(2024, 3, 2, tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+SECOND_NS = 1_000_000_000
+
+
+def _late_record_across_midnight():
+    # Sequence order: before midnight, after midnight, then a reply still stamped before midnight
+    msg_times = [MIDNIGHT_NS - 2 * SECOND_NS, MIDNIGHT_NS - SECOND_NS, MIDNIGHT_NS + SECOND_NS,
+                 MIDNIGHT_NS - SECOND_NS // 2, MIDNIGHT_NS + 2 * SECOND_NS]
+    return [{'seq': seq, 'msg_time': msg_time} for seq, msg_time in enumerate(msg_times, start=1)]
+
+
+@pytest.mark.parametrize('seekable, buffered', [(False, False), (False, True), (True, False), (True, True)])
+def test_late_record_across_midnight_is_kept(tmp_path, seekable, buffered):
+    writer = DailyGzipJsonWriter(str(tmp_path), 'log', seekable=seekable, block_messages=2, buffered=buffered,
+                                 durability='flush')
+    records = _late_record_across_midnight()
+    for record in records:
+        writer.write(dict(record))
+    writer.close()
+
+    reader = DailyGzipJsonReader(str(tmp_path), 'log')
+    every_record = list(reader.read(MIDNIGHT_NS - 10 * SECOND_NS, MIDNIGHT_NS + 10 * SECOND_NS))
+    assert [record['seq'] for record in every_record] == [1, 2, 3, 4, 5]
+    # The late record went into the new day's file but still belongs to the previous day
+    previous_day = list(reader.read(MIDNIGHT_NS - 10 * SECOND_NS, MIDNIGHT_NS - 1))
+    assert [record['seq'] for record in previous_day] == [1, 2, 4]
+    new_day = list(reader.read(MIDNIGHT_NS, MIDNIGHT_NS + 10 * SECOND_NS))
+    assert [record['seq'] for record in new_day] == [3, 5]
+
+
+def test_unbuffered_seekable_block_is_cut_on_flush_interval(tmp_path):
+    writer = DailyGzipJsonWriter(str(tmp_path), 'log', seekable=True, block_messages=1000, flush_interval=0.05)
+    reader = DailyGzipJsonReader(str(tmp_path), 'log')
+    writer.write({'seq': 1, 'msg_time': MIDNIGHT_NS})
+    writer.flush()
+    assert list(reader.read(MIDNIGHT_NS, MIDNIGHT_NS + SECOND_NS)) == []
+    time.sleep(0.06)
+    # No more messages arrive, the periodic flush cuts the block once it is flush_interval old
+    writer.flush()
+    assert [record['seq'] for record in reader.read(MIDNIGHT_NS, MIDNIGHT_NS + SECOND_NS)] == [1]
+    writer.write({'seq': 2, 'msg_time': MIDNIGHT_NS + 1})
+    time.sleep(0.06)
+    # A message arriving after the interval cuts the block itself
+    writer.write({'seq': 3, 'msg_time': MIDNIGHT_NS + 2})
+    assert [record['seq'] for record in reader.read(MIDNIGHT_NS, MIDNIGHT_NS + SECOND_NS)] == [1, 2, 3]
+    writer.close()
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+
+import msgpack
+
+from daily_msgpack_reader import DailyMsgpackReader
+from daily_msgpack_writer import DailyMsgpackWriter
+
+MIDNIGHT_NS = int(datetime(2024, 3, 2, tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+SECOND_NS = 1_000_000_000
+
+
+def test_late_record_across_midnight_is_kept(tmp_path):
+    # Sequence order: before midnight, after midnight, then a reply still stamped before midnight
+    msg_times = [MIDNIGHT_NS - SECOND_NS, MIDNIGHT_NS + SECOND_NS, MIDNIGHT_NS - SECOND_NS // 2]
+    writer = DailyMsgpackWriter(str(tmp_path), 'log')
+    for seq, msg_time in enumerate(msg_times, start=1):
+        header = msgpack.packb(['order_book', 'CDC', 'BTC/USD', seq, msg_time])
+        writer.write(msg_time, [header, msgpack.packb({'data': seq})])
+    writer.close()
+
+    reader = DailyMsgpackReader(str(tmp_path), 'log')
+    assert [message.seq for message in reader.read(MIDNIGHT_NS - 10 * SECOND_NS, MIDNIGHT_NS + 10 * SECOND_NS)] == \
+        [1, 2, 3]
+    assert [message.seq for message in reader.read(MIDNIGHT_NS - 10 * SECOND_NS, MIDNIGHT_NS - 1)] == [1, 3]
+    assert [message.seq for message in reader.read(MIDNIGHT_NS, MIDNIGHT_NS + 10 * SECOND_NS)] == [2]
@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+from journal import JournalReader, JournalWriter
+
+MIDNIGHT_NS = int(datetime(2024, 3, 2, tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+SECOND_NS = 1_000_000_000
+
+
+def write_journal(path, msg_times):
+    writer = JournalWriter(str(path), 'journal')
+    for seq, msg_time in enumerate(msg_times, start=1):
+        writer.write(seq, msg_time, b'header%d' % seq, b'payload%d' % seq)
+    writer.close()
+
+
+def test_late_record_across_midnight_keeps_seq_order(tmp_path):
+    # Sequence order: before midnight, after midnight, then a reply still stamped before midnight
+    write_journal(tmp_path, [MIDNIGHT_NS - SECOND_NS, MIDNIGHT_NS + SECOND_NS, MIDNIGHT_NS - SECOND_NS // 2,
+                             MIDNIGHT_NS + 2 * SECOND_NS])
+
+    reader = JournalReader(str(tmp_path), 'journal')
+    assert [record[0] for record in reader.read(from_seq=1)] == [1, 2, 3, 4]
+    assert [record[0] for record in reader.read(from_seq=3)] == [3, 4]
+    assert [record[0] for record in reader.read(from_seq=1, to_seq=3)] == [1, 2, 3]
+    assert [record[0] for record in reader.read(from_time=MIDNIGHT_NS)] == [2, 3, 4]
+    assert reader.read(from_seq=3).__next__()[2:] == (b'header3', b'payload3')
+    assert JournalWriter(str(tmp_path), 'journal').last_seq() == 4
@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+import msgpack
+
+from core.daily_msgpack_writer import DailyMsgpackWriter
+from core.parallel_log_reader import ParallelLogReader
+
+DAY_START_NS = int(datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+MILLISECOND_NS = 1_000_000
+
+
+def write_log(path, records):
+    writer = DailyMsgpackWriter(str(path), 'log')
+    for seq, msg_time in records:
+        header = msgpack.packb(['order_book', 'CDC', 'BTC/USD', seq, msg_time])
+        writer.write(msg_time, [header, msgpack.packb({'data': seq})])
+    writer.close()
+
+
+def test_merge_reorders_late_records_across_sources(tmp_path):
+    # Each log is in sequence order with replies stamped earlier than the record logged before them
+    gateway_a = tmp_path / 'a'
+    gateway_b = tmp_path / 'b'
+    gateway_a.mkdir()
+    gateway_b.mkdir()
+    write_log(gateway_a, [(1, DAY_START_NS + 10 * MILLISECOND_NS), (2, DAY_START_NS + 30 * MILLISECOND_NS),
+                          (3, DAY_START_NS + 20 * MILLISECOND_NS), (4, DAY_START_NS + 50 * MILLISECOND_NS)])
+    write_log(gateway_b, [(5, DAY_START_NS + 25 * MILLISECOND_NS), (6, DAY_START_NS + 15 * MILLISECOND_NS),
+                          (7, DAY_START_NS + 40 * MILLISECOND_NS)])
+
+    reader = ParallelLogReader([(str(gateway_a), 'log', 'msgpack'), (str(gateway_b), 'log', 'msgpack')],
+                               processes=2, chunk_size=2)
+    messages = list(reader.read(DAY_START_NS, DAY_START_NS + 1_000 * MILLISECOND_NS))
+    assert [message['seq'] for message in messages] == [1, 6, 3, 5, 2, 7, 4]
+    assert [message['msg_time'] for message in messages] == sorted(message['msg_time'] for message in messages)